@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import socket
+import tempfile
+import time
+
+from cameraemulator import CameraEmulator, NetworkProfile, make_jpeg, make_liveview_frame
+from cameraremoteapi import CameraRemoteApi
+from download import save_picture
+from liveview import LiveviewStreamReader
+from rpcsession import load_event_results
+
+BASELINE_FILE = "benchmark_baseline.json"
+
+# never connected to
+OVERHEAD_ENDPOINT_URL = "http://127.0.0.1/sony/camera"
+
+
+class Result(object):
+
+    def __init__(self, name, value, unit, higher_is_better=True):
+        self.name = name
+        self.value = value
+        self.unit = unit
+        self.higher_is_better = higher_is_better
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class ImmediateResponse(object):
+    """Response to a call, answering the request id at once"""
+
+    status = 200
+
+    def __init__(self, data):
+        self.__body = json.dumps({"id": json.loads(data.decode("ascii"))["id"], "result": ["still"]})
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def read(self):
+        return self.__body.encode("utf-8")
+
+
+class ImmediateHttpPool(object):
+    """Http pool answering every call without any network"""
+
+    def post(self, purpose, url, data=None, **kwargs):
+        return ImmediateResponse(data)
+
+    def close(self):
+        pass
+
+
+async def bench_rpc_overhead(camera_api, args):
+    """Client side cost of a call, the transport answering immediately"""
+    overhead_api = CameraRemoteApi(OVERHEAD_ENDPOINT_URL, asyncio.get_event_loop(),
+                                   http_pool=ImmediateHttpPool())
+    overhead_api.set_available_api_list(["getShootMode"])
+    try:
+        start = time.perf_counter()
+        for _ in range(args.calls):
+            await overhead_api.getShootMode()
+        elapsed = time.perf_counter() - start
+    finally:
+        overhead_api.close()
+    return Result("rpc_overhead", elapsed / args.calls * 1e6, "us/call", higher_is_better=False)
+
+
+async def bench_rpc_round_trip(camera_api, args):
+    calls = args.calls // 10
+    start = time.perf_counter()
+    for _ in range(calls):
+        await camera_api.getShootMode()
+    elapsed = time.perf_counter() - start
+    return Result("rpc_round_trip", elapsed / calls * 1e6, "us/call", higher_is_better=False)
+
+
+async def bench_event_dispatch(camera_api, args):
+    if args.events is not None:
+        with open(args.events) as fd:
+            results = json.load(fd)
+    elif args.session is not None:
+        results = load_event_results(args.session)
+    else:
+        results = [await camera_api.getEvent(longPollingFlag=False)]
+
+    items = 0
+    events_watcher = camera_api.get_events_watcher()
+    callbacks = {}
+    for event_name in events_watcher.get_event_names():
+        callbacks[event_name] = lambda data: None
+    events_watcher.register_events(callbacks, full_dispatch=args.full_dispatch)
+    for result in results:
+        items += sum(len(item) if type(item) == list else 1 for item in result[1:] if item)
+
+    iterations = max(args.calls // len(results), 1)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for result in results:
+            events_watcher.process_event_result(result)
+    elapsed = time.perf_counter() - start
+    return Result("event_dispatch", items * iterations / elapsed, "items/s")
+
+
+async def bench_liveview_parse(camera_api, args):
+    frame = make_liveview_frame(0, 0, make_jpeg(args.liveview_frame_size))
+    stream = asyncio.StreamReader(limit=2 * len(frame))
+    stream.feed_data(frame * args.frames)
+    stream.feed_eof()
+    frames = 0
+    start = time.perf_counter()
+    async for _ in LiveviewStreamReader(stream):
+        frames += 1
+    elapsed = time.perf_counter() - start
+    return Result("liveview_parse", frames / elapsed, "frames/s")
+
+
+async def bench_jpeg_decode(camera_api, args):
+    try:
+        from PyQt5 import QtGui
+    except ImportError:
+        return None
+    data = make_jpeg(args.liveview_frame_size)
+    start = time.perf_counter()
+    for _ in range(args.frames):
+        QtGui.QImage.fromData(data, "JPG")
+    elapsed = time.perf_counter() - start
+    return Result("jpeg_decode", args.frames / elapsed, "frames/s")
+
+
+async def bench_picture_download(camera_api, args):
+    result = await camera_api.actTakePicture()
+    url = result[0][0]
+    directory = tempfile.mkdtemp()
+    try:
+        downloaded = 0
+        start = time.perf_counter()
+        for _ in range(args.pictures):
+            path = await save_picture(camera_api.get_http_pool(), url, directory)
+            downloaded += os.path.getsize(path)
+        elapsed = time.perf_counter() - start
+    finally:
+        shutil.rmtree(directory)
+    return Result("picture_download", downloaded / elapsed / 1e6, "MB/s")
+
+
+# the event dispatch comes last: recorded events may change the available
+# api list
+BENCHMARKS = [
+    bench_rpc_overhead,
+    bench_rpc_round_trip,
+    bench_liveview_parse,
+    bench_jpeg_decode,
+    bench_picture_download,
+    bench_event_dispatch,
+]
+
+
+async def run(args):
+    port = free_port()
+    emulator = CameraEmulator(
+        port=port,
+        profile=NetworkProfile(args.latency, args.jitter, args.bandwidth),
+        picture_size=args.picture_size,
+    )
+    await emulator.start()
+    camera_api = CameraRemoteApi(emulator.get_endpoint_url(), asyncio.get_event_loop())
+    results = []
+    try:
+        await camera_api.initial_checks()
+        await camera_api.startRecMode()
+        for benchmark in BENCHMARKS:
+            result = await benchmark(camera_api, args)
+            if result is not None:
+                results.append(result)
+    finally:
+        camera_api.close()
+        await emulator.stop()
+    return results
+
+
+def report(results, baseline):
+    for result in results:
+        line = "%-20s %12.2f %-9s" % (result.name, result.value, result.unit)
+        reference = baseline.get(result.name)
+        if reference:
+            delta = (result.value - reference) / reference * 100
+            better = delta > 0 if result.higher_is_better else delta < 0
+            line += " %+7.1f%% %s" % (delta, "better" if better else "worse")
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks against the camera emulator")
+    parser.add_argument("--calls", type=int, default=10000)
+    parser.add_argument("--frames", type=int, default=3000)
+    parser.add_argument("--pictures", type=int, default=20)
+    parser.add_argument("--picture-size", type=int, default=2 * 1024 * 1024)
+    parser.add_argument("--liveview-frame-size", type=int, default=30 * 1024)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--bandwidth", type=float, default=0)
+    parser.add_argument("--events", help="json file with a list of recorded getEvent results")
+    parser.add_argument("--session",
+                        help="session file recorded with --record-session, its events are dispatched")
+    parser.add_argument("--full-dispatch", action="store_true")
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="store the results as the new baseline")
+    args = parser.parse_args()
+
+    loop = asyncio.get_event_loop()
+    try:
+        results = loop.run_until_complete(run(args))
+    finally:
+        loop.close()
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as fd:
+            baseline = json.load(fd)
+    report(results, baseline)
+    if args.save_baseline:
+        with open(args.baseline, "w") as fd:
+            json.dump({result.name: result.value for result in results}, fd, indent=4, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+
+import aiohttp
+import asyncio
+from collections import deque, OrderedDict
+import logging
+
+from downloadmanager import PRIORITY_ARCHIVE
+from metrics import REGISTRY
+
+logger = logging.getLogger("cameraremote")
+
+DEFAULT_WORKERS = 3
+DEFAULT_QUEUE_SIZE = 16
+
+# urls waiting for room in the queue, the next ones are dropped
+DEFAULT_OVERFLOW_SIZE = 256
+
+# number of urls remembered for the deduplication
+SEEN_URLS_SIZE = 1024
+
+
+class BurstDownloader(object):
+    """Downloads the pictures of a burst with a few workers, through a
+    DownloadManager
+
+    Urls go through a bounded queue: put waits while it is full. The
+    event callbacks never block the events watcher: urls which do not fit
+    in the queue are deferred to a bounded overflow, moved to the queue by
+    a feeder task as the workers catch up, and dropped once the overflow
+    is full. An url already seen during the burst is dropped: some cameras
+    give the same urls to every burst, start_burst forgets them.
+    callback(path) is called after each download.
+    """
+
+    def __init__(self, download_manager, workers=DEFAULT_WORKERS, queue_size=DEFAULT_QUEUE_SIZE,
+                 callback=None, overflow_size=DEFAULT_OVERFLOW_SIZE):
+        self.__download_manager = download_manager
+        self.__workers_count = workers
+        self.__queue = asyncio.Queue(queue_size)
+        self.__callback = callback
+        self.__seen_urls = OrderedDict()
+        self.__overflow = deque()
+        self.__overflow_size = overflow_size
+        self.__overflow_event = asyncio.Event()
+        self.__overflow_drained = asyncio.Event()
+        self.__overflow_drained.set()
+        self.__tasks = []
+        self.__stats = {"queued": 0, "duplicates": 0, "deferred": 0, "dropped": 0,
+                        "downloaded": 0, "failed": 0, "cancelled": 0}
+
+    def start(self):
+        self.__tasks = [
+            asyncio.ensure_future(self.__worker()) for _ in range(self.__workers_count)
+        ]
+        self.__tasks.append(asyncio.ensure_future(self.__feeder()))
+
+    def get_stats(self):
+        stats = dict(self.__stats)
+        stats["pending"] = self.__queue.qsize() + len(self.__overflow)
+        return stats
+
+    def start_burst(self):
+        """To be called before each burst"""
+        self.__seen_urls.clear()
+
+    def __is_new(self, url):
+        if url in self.__seen_urls:
+            self.__stats["duplicates"] += 1
+            return False
+        self.__seen_urls[url] = None
+        if len(self.__seen_urls) > SEEN_URLS_SIZE:
+            self.__seen_urls.popitem(last=False)
+        return True
+
+    async def put(self, url):
+        """Queues an url, waits while the queue is full. Returns False if
+        the url was already queued"""
+        if not self.__is_new(url):
+            return False
+        await self.__queue.put(url)
+        self.__stats["queued"] += 1
+        REGISTRY.set("burst_queue_length", self.__queue.qsize())
+        return True
+
+    def __queue_urls(self, urls):
+        for url in urls:
+            if not self.__is_new(url):
+                continue
+            if not self.__overflow and not self.__queue.full():
+                self.__queue.put_nowait(url)
+                self.__stats["queued"] += 1
+            elif len(self.__overflow) < self.__overflow_size:
+                self.__overflow.append(url)
+                self.__overflow_drained.clear()
+                self.__overflow_event.set()
+                self.__stats["deferred"] += 1
+            else:
+                self.__stats["dropped"] += 1
+                REGISTRY.inc("burst_dropped_total")
+                logger.warning("burst overflow full, %s dropped" % (url,))
+        REGISTRY.set("burst_queue_length", self.__queue.qsize() + len(self.__overflow))
+
+    async def __feeder(self):
+        while True:
+            while not self.__overflow:
+                self.__overflow_drained.set()
+                self.__overflow_event.clear()
+                await self.__overflow_event.wait()
+            # the url leaves the overflow only once it is in the queue, for
+            # join and the ordering of the next urls
+            await self.__queue.put(self.__overflow[0])
+            self.__overflow.popleft()
+            self.__stats["queued"] += 1
+
+    def __cont_shooting_callback(self, data):
+        self.__queue_urls([item["postviewUrl"] for item in data["contShootingUrl"]])
+
+    def __take_picture_callback(self, data):
+        self.__queue_urls(data["takePictureUrl"])
+
+    def get_event_callbacks(self):
+        """Returns the callbacks to register (with full_dispatch) to the
+        events watcher"""
+        return {
+            "contShooting": self.__cont_shooting_callback,
+            "takePicture": self.__take_picture_callback,
+        }
+
+    async def __worker(self):
+        while True:
+            url = await self.__queue.get()
+            REGISTRY.set("burst_queue_length", self.__queue.qsize())
+            future = self.__download_manager.download(url, PRIORITY_ARCHIVE)
+            try:
+                # shielded: closing the downloader does not cancel the
+                # download, which may be shared
+                path = await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    # the worker itself is cancelled
+                    raise
+                self.__stats["cancelled"] += 1
+                logger.warning("burst picture %s download cancelled" % (url,))
+            except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+                self.__stats["failed"] += 1
+                logger.error("burst picture %s download failed: %s" % (url, str(e)))
+            else:
+                if path is not None:
+                    self.__stats["downloaded"] += 1
+                    if self.__callback is not None:
+                        self.__callback(path)
+            finally:
+                self.__queue.task_done()
+
+    async def join(self):
+        """Waits for the queued and deferred pictures to be downloaded"""
+        await self.__overflow_drained.wait()
+        await self.__queue.join()
+
+    def close(self):
+        for task in self.__tasks:
+            task.cancel()
+        self.__tasks = []
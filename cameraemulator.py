@@ -0,0 +1,428 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from aiohttp import web
+import argparse
+import asyncio
+import base64
+import json
+import logging
+import random
+import time
+
+from liveview import HEADERS, HEADERS_SIZE, PAYLOAD_START_CODE, PAYLOAD_TYPE_JPEG, START_BYTE
+from utils import lower_first_letter, upper_first_letter
+
+logger = logging.getLogger("cameraremote")
+
+# 16x12 pixels jpeg image, made bigger with comment segments
+JPEG_IMAGE = base64.b64decode(
+    "/9j/4AAQSkZJRgABAQAAAQABAAD/2wBDABALDA4MChAODQ4SERATGCgaGBYWGDEjJR0oOjM9"
+    "PDkzODdASFxOQERXRTc4UG1RV19iZ2hnPk1xeXBkeFxlZ2P/2wBDARESEhgVGC8aGi9jQjhC"
+    "Y2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2P/wAAR"
+    "CAAMABADASIAAhEBAxEB/8QAFQABAQAAAAAAAAAAAAAAAAAAAAP/xAAUEAEAAAAAAAAAAAAA"
+    "AAAAAAAA/8QAFAEBAAAAAAAAAAAAAAAAAAAABP/EABQRAQAAAAAAAAAAAAAAAAAAAAD/2gAM"
+    "AwEAAhEDEQA/AIgGDv/Z"
+)
+MAX_SEGMENT_SIZE = 0xffff
+
+# size of the chunks written by the streaming handlers
+CHUNK_SIZE = 64 * 1024
+
+SERVER_APIS = [
+    "getAvailableApiList",
+    "getApplicationInfo",
+    "getVersions",
+    "getMethodTypes",
+    "getEvent",
+    "startRecMode",
+    "stopRecMode",
+]
+
+SHOOTING_APIS = [
+    "actTakePicture",
+    "startLiveview",
+    "stopLiveview",
+    "actHalfPressShutter",
+    "cancelHalfPressShutter",
+    "setExposureCompensation",
+    "getExposureCompensation",
+    "getAvailableExposureCompensation",
+    "startContShooting",
+    "stopContShooting",
+]
+
+# current value and candidates of the emulated settings
+SETTINGS = {
+    "shootMode": ("still", ["still", "movie"]),
+    "exposureMode": ("Program Auto", ["Program Auto", "Aperture", "Shutter", "Manual",
+                                      "Intelligent Auto", "Superior Auto"]),
+    "fNumber": ("5.6", ["3.5", "4.0", "4.5", "5.0", "5.6", "6.3", "7.1", "8.0", "9.0",
+                        "10", "11", "13", "14", "16", "18", "20", "22"]),
+    "shutterSpeed": ("1/125", ["30\"", "15\"", "8\"", "4\"", "2\"", "1\"", "1/2", "1/4",
+                               "1/8", "1/15", "1/30", "1/60", "1/125", "1/250", "1/500",
+                               "1/1000", "1/2000", "1/4000"]),
+    "isoSpeedRate": ("AUTO", ["AUTO", "100", "200", "400", "800", "1600", "3200", "6400"]),
+    "focusMode": ("AF-S", ["AF-S", "AF-C", "DMF", "MF"]),
+    "flashMode": ("off", ["off", "auto", "on"]),
+    "postviewImageSize": ("2M", ["Original", "2M"]),
+    "selfTimer": (0, [0, 2, 10]),
+}
+EXPOSURE_COMPENSATION_RANGE = (-15, 15, 1)
+
+
+def make_jpeg(size):
+    """Returns a valid jpeg image of at least size bytes"""
+    padding = []
+    padding_size = size - len(JPEG_IMAGE)
+    while padding_size > 0:
+        segment_size = min(padding_size, MAX_SEGMENT_SIZE + 2)
+        data_size = max(segment_size - 4, 0)
+        padding.append(b"\xff\xfe" + (data_size + 2).to_bytes(2, "big") + bytes(data_size))
+        padding_size -= data_size + 4
+    return JPEG_IMAGE[:2] + b"".join(padding) + JPEG_IMAGE[2:]
+
+
+def make_liveview_frame(sequence_number, timestamp, payload):
+    sizes = len(payload) << 8
+    headers = HEADERS.pack(START_BYTE, PAYLOAD_TYPE_JPEG, sequence_number & 0xffff,
+                           timestamp & 0xffffffff, PAYLOAD_START_CODE, sizes)
+    return headers + bytes(HEADERS_SIZE - HEADERS.size) + payload
+
+
+async def write(response, data):
+    # StreamResponse.write is a coroutine in recent aiohttp versions
+    result = response.write(data)
+    if asyncio.iscoroutine(result):
+        await result
+    else:
+        await response.drain()
+
+
+class NetworkProfile(object):
+    """Emulated network: latency and jitter in seconds, bandwidth in bytes
+    per second (0 for unlimited)"""
+
+    def __init__(self, latency=0.0, jitter=0.0, bandwidth=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+
+    async def delay(self):
+        delay = self.latency
+        if self.jitter:
+            delay += random.uniform(0, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def transfer(self, size):
+        if self.bandwidth:
+            await asyncio.sleep(size / self.bandwidth)
+
+
+class CameraEmulator(object):
+    """Emulates the camera service of a Sony camera
+
+    The json-rpc endpoint, the postview pictures and the liveview stream
+    are served with the latency, jitter and bandwidth of the network
+    profile, for benchmarking without a real camera.
+    """
+
+    def __init__(self, host="127.0.0.1", port=8080, profile=None,
+                 picture_size=2 * 1024 * 1024, liveview_frame_size=30 * 1024,
+                 liveview_fps=30, event_timeout=10, cont_shooting_fps=10):
+        self.__host = host
+        self.__port = port
+        self.__profile = profile if profile is not None else NetworkProfile()
+        self.__picture = make_jpeg(picture_size)
+        self.__liveview_frame = make_jpeg(liveview_frame_size)
+        self.__liveview_fps = liveview_fps
+        self.__event_timeout = event_timeout
+
+        self.__settings = {name: value for name, (value, _) in SETTINGS.items()}
+        self.__exposure_compensation = 0
+        self.__rec_mode = False
+        self.__liveview = False
+        self.__camera_status = "IDLE"
+        self.__picture_number = 0
+        self.__picture_urls = []
+        self.__cont_shooting_fps = cont_shooting_fps
+        self.__cont_shooting_task = None
+        self.__cont_shooting_urls = []
+
+        self.__event_version = 0
+        self.__polled_version = -1
+        self.__changed = asyncio.Event()
+
+        self.__server = None
+        self.__handler = None
+
+    def get_endpoint_url(self):
+        return "http://%s:%d/sony/camera" % (self.__host, self.__port)
+
+    def __base_url(self):
+        return "http://%s:%d" % (self.__host, self.__port)
+
+    async def start(self):
+        loop = asyncio.get_event_loop()
+        app = web.Application(loop=loop)
+        app.router.add_route("POST", "/sony/camera", self.__camera_handler)
+        app.router.add_route("GET", "/postview/{name}", self.__postview_handler)
+        app.router.add_route("GET", "/liveview/liveviewstream", self.__liveview_handler)
+        self.__handler = app.make_handler()
+        self.__server = await loop.create_server(self.__handler, self.__host, self.__port)
+        logger.info("camera emulator listening on %s" % (self.get_endpoint_url(),))
+
+    async def stop(self):
+        if self.__cont_shooting_task is not None:
+            self.__cont_shooting_task.cancel()
+            self.__cont_shooting_task = None
+        if self.__server is not None:
+            self.__server.close()
+            await self.__server.wait_closed()
+            self.__server = None
+
+    def __notify(self):
+        self.__event_version += 1
+        self.__changed.set()
+        self.__changed = asyncio.Event()
+
+    def __available_api_list(self):
+        apis = list(SERVER_APIS)
+        if self.__rec_mode:
+            apis.extend(SHOOTING_APIS)
+            for name in SETTINGS:
+                capitalized_name = upper_first_letter(name)
+                for prefix in ("set", "get", "getSupported", "getAvailable"):
+                    apis.append(prefix + capitalized_name)
+        return apis
+
+    def __setting_event(self, name):
+        candidates = SETTINGS[name][1]
+        capitalized_name = upper_first_letter(name)
+        return {
+            "type": name,
+            "current" + capitalized_name: self.__settings[name],
+            name + "Candidates": candidates,
+        }
+
+    async def __get_event(self, long_polling):
+        if long_polling and self.__event_version == self.__polled_version:
+            try:
+                await asyncio.wait_for(self.__changed.wait(), self.__event_timeout)
+            except asyncio.TimeoutError:
+                pass
+        self.__polled_version = self.__event_version
+
+        take_picture = None
+        if self.__picture_urls:
+            take_picture = [{"type": "takePicture", "takePictureUrl": self.__picture_urls}]
+            self.__picture_urls = []
+        cont_shooting = None
+        if self.__cont_shooting_urls:
+            cont_shooting = {"type": "contShooting", "contShootingUrl": self.__cont_shooting_urls}
+            self.__cont_shooting_urls = []
+        min_, max_, step = EXPOSURE_COMPENSATION_RANGE
+        result = [
+            {"type": "availableApiList", "names": self.__available_api_list()},
+            {"type": "cameraStatus", "cameraStatus": self.__camera_status},
+            None,
+            {"type": "liveviewStatus", "liveviewStatus": self.__liveview},
+            None,
+            take_picture,
+            {
+                "type": "exposureCompensation",
+                "currentExposureCompensation": self.__exposure_compensation,
+                "maxExposureCompensation": max_,
+                "minExposureCompensation": min_,
+                "stepIndexOfExposureCompensation": step,
+            },
+        ]
+        for name in SETTINGS:
+            result.append(self.__setting_event(name))
+        result.append(cont_shooting)
+        return result
+
+    async def __take_picture(self):
+        self.__camera_status = "StillCapturing"
+        self.__notify()
+        self.__picture_number += 1
+        url = "%s/postview/pict%04d.JPG" % (self.__base_url(), self.__picture_number)
+        self.__picture_urls.append(url)
+        self.__camera_status = "IDLE"
+        self.__notify()
+        return [[url]]
+
+    async def __cont_shooting(self):
+        period = 1 / self.__cont_shooting_fps
+        start = time.monotonic()
+        shots = 0
+        while True:
+            self.__picture_number += 1
+            url = "%s/postview/pict%04d.JPG" % (self.__base_url(), self.__picture_number)
+            self.__cont_shooting_urls.append({"postviewUrl": url, "thumbnailUrl": url})
+            self.__notify()
+            shots += 1
+            await asyncio.sleep(max(start + shots * period - time.monotonic(), 0))
+
+    async def __call(self, name, params):
+        """Returns the result of a method, raises ValueError with an error
+        code and message"""
+        if name not in self.__available_api_list():
+            raise ValueError(12, "No Such Method")
+
+        if name == "getAvailableApiList":
+            return [self.__available_api_list()]
+        if name == "getApplicationInfo":
+            return ["Camera Emulator", "2.1.4"]
+        if name == "getVersions":
+            return [["1.0"]]
+        if name == "getMethodTypes":
+            return [[method, [], [], "1.0"] for method in self.__available_api_list()]
+        if name == "getEvent":
+            return await self.__get_event(bool(params and params[0]))
+        if name in ("startRecMode", "stopRecMode"):
+            self.__rec_mode = name == "startRecMode"
+            self.__notify()
+            return [0]
+        if name == "actTakePicture":
+            return await self.__take_picture()
+        if name == "startLiveview":
+            self.__liveview = True
+            self.__notify()
+            return [self.__base_url() + "/liveview/liveviewstream"]
+        if name == "stopLiveview":
+            self.__liveview = False
+            self.__notify()
+            return [0]
+        if name == "startContShooting":
+            if self.__cont_shooting_task is None:
+                self.__camera_status = "StillCapturing"
+                self.__cont_shooting_task = asyncio.ensure_future(self.__cont_shooting())
+            return [0]
+        if name == "stopContShooting":
+            if self.__cont_shooting_task is not None:
+                self.__cont_shooting_task.cancel()
+                self.__cont_shooting_task = None
+                self.__camera_status = "IDLE"
+                self.__notify()
+            return [0]
+        if name in ("actHalfPressShutter", "cancelHalfPressShutter"):
+            return [0]
+
+        if name == "setExposureCompensation":
+            min_, max_, step = EXPOSURE_COMPENSATION_RANGE
+            if not params or not min_ <= params[0] <= max_:
+                raise ValueError(3, "Illegal Argument")
+            self.__exposure_compensation = params[0]
+            self.__notify()
+            return [0]
+        if name == "getExposureCompensation":
+            return [self.__exposure_compensation]
+        if name == "getAvailableExposureCompensation":
+            min_, max_, step = EXPOSURE_COMPENSATION_RANGE
+            return [self.__exposure_compensation, max_, min_, step]
+
+        for prefix in ("getAvailable", "getSupported", "set", "get"):
+            if name.startswith(prefix):
+                setting = lower_first_letter(name[len(prefix):])
+                break
+        candidates = SETTINGS[setting][1]
+        if prefix == "getAvailable":
+            return [self.__settings[setting], candidates]
+        if prefix == "getSupported":
+            return [candidates]
+        if prefix == "get":
+            return [self.__settings[setting]]
+        if not params or params[0] not in candidates:
+            raise ValueError(3, "Illegal Argument")
+        self.__settings[setting] = params[0]
+        self.__notify()
+        return [0]
+
+    async def __camera_handler(self, request):
+        data = await request.json()
+        await self.__profile.delay()
+        response = {"id": data.get("id")}
+        try:
+            response["result"] = await self.__call(data["method"], data.get("params", []))
+        except ValueError as e:
+            response["error"] = list(e.args)
+        body = json.dumps(response).encode("utf-8")
+        await self.__profile.transfer(len(body))
+        return web.Response(body=body, content_type="application/json")
+
+    async def __postview_handler(self, request):
+        await self.__profile.delay()
+        # only the "bytes=start-" ranges of resumed downloads are supported
+        start = 0
+        range_ = request.headers.get("RANGE", "")
+        if range_.startswith("bytes=") and range_.endswith("-"):
+            start = int(range_[len("bytes="):-1])
+            if start >= len(self.__picture):
+                return web.Response(status=416)
+        response = web.StreamResponse(status=206 if start else 200)
+        response.content_type = "image/jpeg"
+        response.content_length = len(self.__picture) - start
+        await response.prepare(request)
+        for offset in range(start, len(self.__picture), CHUNK_SIZE):
+            chunk = self.__picture[offset:offset + CHUNK_SIZE]
+            await self.__profile.transfer(len(chunk))
+            await write(response, chunk)
+        return response
+
+    async def __liveview_handler(self, request):
+        await self.__profile.delay()
+        response = web.StreamResponse()
+        response.content_type = "image/jpeg"
+        await response.prepare(request)
+        period = 1 / self.__liveview_fps
+        start = time.monotonic()
+        sequence_number = 0
+        while self.__liveview:
+            timestamp = int((time.monotonic() - start) * 1000)
+            frame = make_liveview_frame(sequence_number, timestamp, self.__liveview_frame)
+            await self.__profile.transfer(len(frame))
+            await write(response, frame)
+            sequence_number += 1
+            # frames are sent at a constant rate
+            delay = start + sequence_number * period - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        return response
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sony camera emulator")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="seconds")
+    parser.add_argument("--bandwidth", type=float, default=0, help="bytes per second")
+    parser.add_argument("--picture-size", type=int, default=2 * 1024 * 1024)
+    parser.add_argument("--liveview-frame-size", type=int, default=30 * 1024)
+    parser.add_argument("--liveview-fps", type=int, default=30)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)-8s %(message)s")
+    loop = asyncio.get_event_loop()
+    emulator = CameraEmulator(
+        args.host,
+        args.port,
+        NetworkProfile(args.latency, args.jitter, args.bandwidth),
+        picture_size=args.picture_size,
+        liveview_frame_size=args.liveview_frame_size,
+        liveview_fps=args.liveview_fps,
+    )
+    loop.run_until_complete(emulator.start())
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loop.run_until_complete(emulator.stop())
+        loop.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+from collections import namedtuple, OrderedDict
+import logging
+import time
+
+from cameraremoteapi import CameraRemoteApi
+
+logger = logging.getLogger("cameraremote")
+
+# results, skews and latencies are dictionaries indexed by endpoint url.
+# the skew of a camera is the delay between the first request written and
+# its own, the latency the time from its request written to its response.
+# a camera whose request was not written has neither
+FanOutResult = namedtuple("FanOutResult", ["results", "skews", "latencies"])
+
+
+class CameraFleet(object):
+    """Several cameras driven from one event loop
+
+    Cameras are indexed by their endpoint url since bodies of the same
+    model share their friendly name. add_camera may be used as the callback
+    of a CameraRemoteControl.
+    """
+
+    def __init__(self, loop=None):
+        self.__loop = loop if loop is not None else asyncio.get_event_loop()
+        self.__cameras = OrderedDict()
+        self.__names = {}
+
+    def __len__(self):
+        return len(self.__cameras)
+
+    def get_cameras(self):
+        """Returns the (endpoint url, device name) pairs of the cameras"""
+        return [(endpoint_url, self.__names[endpoint_url]) for endpoint_url in self.__cameras]
+
+    def get_camera_api(self, endpoint_url):
+        return self.__cameras[endpoint_url]
+
+    async def add_camera(self, device_name, endpoint_url):
+        if endpoint_url in self.__cameras:
+            return
+        camera_api = CameraRemoteApi(endpoint_url, self.__loop)
+        try:
+            await camera_api.initial_checks(device_name)
+            if camera_api.is_method_available("startRecMode"):
+                await camera_api.startRecMode()
+            await self.__warm_up(camera_api)
+        except:
+            camera_api.close()
+            raise
+        self.__cameras[endpoint_url] = camera_api
+        self.__names[endpoint_url] = device_name
+        logger.info("fleet: %s added (%s), %d cameras" %
+                    (device_name, endpoint_url, len(self.__cameras)))
+
+    async def __warm_up(self, camera_api):
+        # opens the rpc connection used by fan_out, kept alive by the pool
+        await camera_api.getVersions()
+
+    def remove_camera(self, endpoint_url):
+        camera_api = self.__cameras.pop(endpoint_url)
+        del self.__names[endpoint_url]
+        camera_api.close()
+
+    async def fan_out(self, method, *args, **kwargs):
+        """Calls a method on all the cameras at once
+
+        The requests are checked and prepared for every camera first, then
+        all sent in the same loop iteration over the rpc connections opened
+        by add_camera. The skews are measured when the requests are about to
+        be written, once their connection is acquired. Failed calls give
+        their exception as result.
+        """
+        prepared_calls = OrderedDict()
+        for endpoint_url, camera_api in self.__cameras.items():
+            prepared_calls[endpoint_url] = getattr(camera_api, method).prepare(*args, **kwargs)
+
+        send_times = {}
+        latencies = {}
+
+        async def send(endpoint_url, prepared_call):
+            def sent_callback():
+                send_times[endpoint_url] = time.perf_counter()
+
+            try:
+                return await prepared_call(sent_callback=sent_callback)
+            finally:
+                if endpoint_url in send_times:
+                    latencies[endpoint_url] = time.perf_counter() - send_times[endpoint_url]
+
+        results = await asyncio.gather(
+            *[send(endpoint_url, prepared_call) for endpoint_url, prepared_call in prepared_calls.items()],
+            return_exceptions=True
+        )
+
+        first_send_time = min(send_times.values()) if send_times else 0
+        skews = {
+            endpoint_url: send_time - first_send_time
+            for endpoint_url, send_time in send_times.items()
+        }
+        if skews:
+            logger.debug("fleet: %s sent to %d cameras, max skew %.3f ms" %
+                         (method, len(skews), max(skews.values()) * 1000))
+        return FanOutResult(OrderedDict(zip(prepared_calls, results)), skews, latencies)
+
+    async def take_picture(self):
+        return await self.fan_out("actTakePicture")
+
+    def close(self):
+        for camera_api in self.__cameras.values():
+            camera_api.close()
+        self.__cameras.clear()
+        self.__names.clear()
@@ -2,20 +2,47 @@
 # -*- coding: utf-8 -*-
 
 import aiohttp
+import argparse
 import asyncio
-from io import BytesIO
 import logging
-# import os
+import os
 from PyQt5 import QtCore, QtGui, QtWidgets
 from quamash import QEventLoop
 import sys
+import time
 
-from cameraremoteapi import CameraRemoteApi  # , CameraRemoteApiException
+from burstdownloader import BurstDownloader
+from cameraremoteapi import CameraRemoteApi, CameraRemoteException
 from cameraremotecontrol import CameraRemoteControl
-from utils import upper_first_letter
+from downloadmanager import DownloadManager, PRIORITY_PREVIEW
+from endpointcache import EndpointCache
+from liveview import LatestFrameBuffer, LiveviewStreamReader
+from liveviewrecorder import LiveviewRecorder
+from metrics import start_metrics_server
+from picturecache import DEFAULT_MAX_BYTES, PictureCache
+from rpcsession import RpcSessionRecorder
+from utils import read_file, upper_first_letter
 
 # from utils import debug_trace
 
+logger = logging.getLogger("cameraremote")
+
+PICTURES_DIRECTORY = "pictures"
+
+# number of pictures which may be browsed in the picture view
+PICTURE_HISTORY_SIZE = 100
+
+# the picture is rendered again when the window was not resized for this
+# delay (seconds)
+RESIZE_DELAY = 0.2
+
+
+def decode_image(data, size):
+    """Decode a jpeg image and scale it to size. QImage (unlike QPixmap) may
+    be used outside of the gui thread"""
+    image = QtGui.QImage.fromData(data, "JPG")
+    return image.scaled(size, QtCore.Qt.KeepAspectRatio, QtCore.Qt.SmoothTransformation)
+
 
 class CameraRemoteWidget:
 
@@ -25,6 +52,12 @@ class CameraRemoteWidget:
     def get_name(self):
         return self.widget_name
 
+    def available_values_callback(self, available_values):
+        pass
+
+    def capabilities_callback(self, capabilities):
+        pass
+
 
 class CurrentCandidateWidget(CameraRemoteWidget):
 
@@ -44,6 +77,17 @@ class CurrentCandidateWidget(CameraRemoteWidget):
         for choice in data["Candidates"]:
             self.__widget_combo_box.addItem(str(choice))
 
+    def available_values_callback(self, available_values):
+        # the getAvailable* results are [current, candidates] except for
+        # ranges (min, max, step) which come with the events
+        result = available_values.get(self.widget_name)
+        if result is not None and len(result) == 2 and isinstance(result[1], list):
+            self.event_callback({"Current": result[0], "Candidates": result[1]})
+
+    def capabilities_callback(self, capabilities):
+        function_name = "set" + upper_first_letter(self.widget_name)
+        self.__widget_combo_box.setEnabled(function_name in capabilities)
+
     def __submit(self):
         value = self.__type(self.__widget_combo_box.currentText())
         kwargs = {self.widget_name: value}
@@ -69,20 +113,27 @@ class CurrentCandidateWidget(CameraRemoteWidget):
 
 
 class ActionWidget(CameraRemoteWidget):
+    """Button calling an api method, after submit_hook() if given"""
 
-    def __init__(self, camera_remote, widget_name, button_caption):
+    def __init__(self, camera_remote, widget_name, button_caption, submit_hook=None):
         self.camera_remote = camera_remote
         self.widget_name = widget_name
         self.__button_caption = button_caption
+        self.__submit_hook = submit_hook
         self.__widget_button = None
 
     def get_event_callback(self):
         return
 
+    def capabilities_callback(self, capabilities):
+        self.__widget_button.setEnabled(self.widget_name in capabilities)
+
     def __submit(self):
         function_name = self.widget_name
 
         logger.info("action %s" % (function_name,))
+        if self.__submit_hook is not None:
+            self.__submit_hook()
         function = getattr(self.camera_remote.camera_api, function_name)
         function_future = asyncio.ensure_future(function())
         function_future.add_done_callback(self.submit_callback)
@@ -92,9 +143,9 @@ class ActionWidget(CameraRemoteWidget):
 
     def make_widget_group_box(self):
         hbox_layout = QtWidgets.QHBoxLayout()
-        button = QtWidgets.QPushButton(self.__button_caption)
-        button.clicked.connect(self.__submit)
-        hbox_layout.addWidget(button)
+        self.__widget_button = QtWidgets.QPushButton(self.__button_caption)
+        self.__widget_button.clicked.connect(self.__submit)
+        hbox_layout.addWidget(self.__widget_button)
         group_box = QtWidgets.QGroupBox()
 
         group_box.setLayout(hbox_layout)
@@ -116,9 +167,7 @@ class TakePictureWidget(ActionWidget):
     def submit_callback(self, f):
         result = f.result()
         url = result[0][0]
-        self.camera_remote.download_task = asyncio.ensure_future(
-            self.camera_remote.download_picture(url)
-        )
+        asyncio.ensure_future(self.camera_remote.download_picture(url))
 
 
 class WhiteBalanceWidget(CameraRemoteWidget):
@@ -130,6 +179,7 @@ class WhiteBalanceWidget(CameraRemoteWidget):
         self.__white_balance_mode_combo_box = None
         self.__color_temperature_label = None
         self.__color_temperature_combo_box = None
+        self.__submit_button = None
         self.__white_balance_modes = {}
 
     def __on_white_balance_mode_changed(self):
@@ -175,6 +225,9 @@ class WhiteBalanceWidget(CameraRemoteWidget):
             logger.debug("color temperature: check availability")
             asyncio.ensure_future(self.__get_available_white_balance())
 
+    def capabilities_callback(self, capabilities):
+        self.__submit_button.setEnabled("setWhiteBalance" in capabilities)
+
     def __submit(self):
         white_balance_mode = self.__white_balance_mode_combo_box.currentText()
         color_temperature = self.__color_temperature_combo_box.currentText()
@@ -215,12 +268,12 @@ class WhiteBalanceWidget(CameraRemoteWidget):
         color_temperature_group_box = QtWidgets.QGroupBox("Color temperature")
         color_temperature_group_box.setLayout(color_temperature_layout)
 
-        button = QtWidgets.QPushButton("Set white balance")
-        button.clicked.connect(self.__submit)
+        self.__submit_button = QtWidgets.QPushButton("Set white balance")
+        self.__submit_button.clicked.connect(self.__submit)
 
         hbox_layout.addWidget(white_balance_mode_group_box)
         hbox_layout.addWidget(color_temperature_group_box)
-        hbox_layout.addWidget(button)
+        hbox_layout.addWidget(self.__submit_button)
 
         group_box = QtWidgets.QGroupBox("White balance")
         group_box.setLayout(hbox_layout)
@@ -229,8 +282,19 @@ class WhiteBalanceWidget(CameraRemoteWidget):
 
 class CameraRemote(QtWidgets.QMainWindow):
 
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, endpoint_url=None, session_recorder=None,
+                 picture_cache_size=DEFAULT_MAX_BYTES):
         QtWidgets.QMainWindow.__init__(self, parent)
+        self.__session_recorder = session_recorder
+
+        # pictures saved to PICTURES_DIRECTORY are read back from there once
+        # evicted from memory
+        self.__picture_cache = PictureCache(picture_cache_size, PICTURES_DIRECTORY)
+        # file names of the last pictures, oldest first
+        self.__picture_history = []
+        self.__history_index = -1
+        self.__shown_picture = None
+        self.__resize_handle = None
 
         # --- Tabs
         self.__TABS = ["color", "exposure", "flash", "focus", "liveview", "movie", "shoot", "sound"]
@@ -336,6 +400,17 @@ class CameraRemote(QtWidgets.QMainWindow):
                 "position": (2, 2),
                 "widget": TakePictureWidget(self, "actTakePicture", "Take picture")
             },
+            {
+                "tab": "shoot",
+                "position": (3, 0),
+                "widget": ActionWidget(self, "startContShooting", "Start continuous shooting",
+                                       self.__start_burst)
+            },
+            {
+                "tab": "shoot",
+                "position": (3, 1),
+                "widget": ActionWidget(self, "stopContShooting", "Stop continuous shooting")
+            },
             {
                 "tab": "sound",
                 "position": (0, 0),
@@ -345,25 +420,41 @@ class CameraRemote(QtWidgets.QMainWindow):
 
         self.__init_ui()
         self.camera_api = None
-        self.__camera_remote_control = CameraRemoteControl(
-            "ILCE",
-            self.__device_available_callback
-        )
+        if endpoint_url is not None:
+            self.__camera_remote_control = None
+            asyncio.ensure_future(self.__device_available_callback(None, endpoint_url))
+        else:
+            self.__camera_remote_control = CameraRemoteControl(
+                "ILCE",
+                self.__device_available_callback,
+                EndpointCache()
+            )
 
         self.__closing_actions = False
 
-        # lock for downloading only one picture at a time. this prevents from
-        # sharing the progress bar and the pixmap which are unique. this way a
-        # picture will be shown while the next is beeing downloded...
-        self.__download_lock = asyncio.Lock()
+        self.__download_manager = None
+        # the progress bar and the picture view show the last picture
+        # requested, older downloads go on in the background
+        self.__shown_url = None
 
         self.liveview_task = None
-        self.download_task = None
+        self.__burst_downloader = None
+
+    def __start_burst(self):
+        if self.__burst_downloader is not None:
+            self.__burst_downloader.start_burst()
 
     def __take_picture_callback(self, data):
         urls = data["takePictureUrl"]
         for url in urls:
-            self.download_task = asyncio.ensure_future(self.download_picture(url))
+            asyncio.ensure_future(self.download_picture(url))
+
+    def __burst_picture_callback(self, path):
+        logger.info("burst picture %s saved" % (path,))
+
+    def __capabilities_callback(self, capabilities, added, removed):
+        for widget in self.__WIDGETS:
+            widget["widget"].capabilities_callback(capabilities)
 
     def __update_status_callback(self, data):
         self.__status_label.setText(data["cameraStatus"])
@@ -371,10 +462,14 @@ class CameraRemote(QtWidgets.QMainWindow):
     async def __device_available_callback(self, device_name, endpoint_url):
         logger.debug("device %s is connected" % (device_name,))
 
-        camera_api = CameraRemoteApi(endpoint_url, loop)
+        camera_api = CameraRemoteApi(endpoint_url, asyncio.get_event_loop(),
+                                     session_recorder=self.__session_recorder)
         self.camera_api = camera_api
 
-        events_watcher = await camera_api.initial_checks()
+        capabilities = camera_api.get_capabilities()
+        capabilities.subscribe(self.__capabilities_callback)
+
+        events_watcher = await camera_api.initial_checks(device_name)
         callbacks = {}
         for widget in self.__WIDGETS:
             callback = widget["widget"].get_event_callback()
@@ -382,98 +477,193 @@ class CameraRemote(QtWidgets.QMainWindow):
             if callback is not None:
                 callbacks[name] = callback
         callbacks.update({"cameraStatus": self.__update_status_callback})
-        callbacks.update({"takePicture": self.__take_picture_callback})
         events_watcher.register_events(callbacks)
+        # every shot must be downloaded, even if its url is the same as the
+        # previous one
+        events_watcher.register_events(
+            {"takePicture": self.__take_picture_callback},
+            full_dispatch=True
+        )
+        self.__download_manager = DownloadManager(camera_api.get_http_pool(), PICTURES_DIRECTORY)
+        self.__download_manager.start()
+        # bursts are only saved, the downloads are too many to be shown
+        self.__burst_downloader = BurstDownloader(
+            self.__download_manager,
+            callback=self.__burst_picture_callback
+        )
+        self.__burst_downloader.start()
+        events_watcher.register_events(
+            {"contShooting": self.__burst_downloader.get_event_callbacks()["contShooting"]},
+            full_dispatch=True
+        )
         events_watcher.start_event_watcher()
 
         await camera_api.startRecMode()
 
-    async def download_liveview(self, url):
+        # refresh all the current / candidates values in one batch
+        available_values = await camera_api.get_available_values()
+        for widget in self.__WIDGETS:
+            widget["widget"].available_values_callback(available_values)
+
+    async def __read_liveview(self, url, frame_buffer, recorder):
+        try:
+            async with self.camera_api.get_http_pool().get("liveview", url) as resp:
+                if resp.status == 200:
+                    async for frame in LiveviewStreamReader(resp.content):
+                        if recorder is not None:
+                            recorder.record(frame)
+                        frame_buffer.put(frame)
+        except CameraRemoteException as e:
+            logger.debug(str(e))
+        except:
+            pass
+        finally:
+            frame_buffer.close()
 
-        async def load_data(plsize, pdsize):
-            with BytesIO() as fd:
-                while plsize > 0:
-                    chunk = await resp.content.read(plsize)
-                    fd.write(chunk)
-                    plsize -= len(chunk)
-                data = fd.getvalue()
-            if pdsize != 0:
-                await resp.content.read(pdsize)
-            return data
-
-        with aiohttp.ClientSession() as session:
-            try:
-                async with session.get(url) as resp:
-                    if resp.status == 200:
-                        while True:
-                            # read common and payload header
-                            headers = await resp.content.read(8 + 128)
-                            if headers[0] != 0xff:
-                                logger.debug("desynchronized from liveview stream")
-                                break
-                            # debug_trace()
-                            payload_size = 0
-                            for byte in headers[12:15]:
-                                payload_size *= 256
-                                payload_size += byte
-                            padding_size = headers[15]
-                            if headers[1] == 1:
-                                data = await load_data(payload_size, padding_size)
-                                pixmap = QtGui.QPixmap()
-                                pixmap.loadFromData(QtCore.QByteArray(data))
-                                scaled_pixmap = pixmap.scaled(
-                                    self.__liveview_view_label.size(),
-                                    QtCore.Qt.KeepAspectRatio,
-                                    QtCore.Qt.SmoothTransformation
-                                )
-                                self.__liveview_view_label.setPixmap(scaled_pixmap)
-                            else:
-                                await load_data(payload_size, padding_size)
-            except:
-                pass
+    async def download_liveview(self, url):
+        # the stream is read in its own task so that it never waits for the
+        # display. only the newest frame is decoded (in a worker thread) and
+        # painted, the others are dropped
+        frame_buffer = LatestFrameBuffer()
+        recorder = None
+        if self.__record_liveview_action.isChecked():
+            recorder = LiveviewRecorder(time.strftime("liveview-%Y%m%d-%H%M%S.mjpeg"))
+            logger.info("recording liveview to %s" % (recorder.get_path(),))
+        read_task = asyncio.ensure_future(self.__read_liveview(url, frame_buffer, recorder))
+        dropped = 0
+        try:
+            while True:
+                frame = await frame_buffer.get()
+                if frame is None:
+                    break
+                image = await asyncio.get_event_loop().run_in_executor(
+                    None,
+                    decode_image,
+                    frame.data,
+                    self.__liveview_view_label.size()
+                )
+                self.__liveview_view_label.setPixmap(QtGui.QPixmap.fromImage(image))
+                if frame_buffer.get_dropped_count() != dropped:
+                    dropped = frame_buffer.get_dropped_count()
+                    self.__liveview_drop_label.setText("liveview: %d dropped frames" % (dropped,))
+        finally:
+            read_task.cancel()
+            if recorder is not None:
+                recorder.close()
+                logger.debug("liveview recording stopped, %d dropped frames" % (recorder.get_dropped_count(),))
+            logger.debug("liveview stopped, %d dropped frames" % (frame_buffer.get_dropped_count(),))
             self.liveview_task = None
 
-    async def download_picture(self, url):
-        with (await self.__download_lock):
-            with aiohttp.ClientSession() as session:
-                try:
-                    async with session.get(url) as resp:
-                        if resp.status == 200:
-                            if resp.headers["CONTENT-TYPE"] == "image/jpeg":
-                                content_length = int(resp.headers["CONTENT-LENGTH"])
-                                downloaded = 0
-                                with BytesIO() as fd:
-                                    while True:
-                                        chunk = await resp.content.read(1024)
-                                        if not chunk:
-                                            break
-                                        downloaded += len(chunk)
-                                        percent = int(downloaded * 100 / content_length)
-                                        self.__download_progress_bar.setValue(percent)
-                                        fd.write(chunk)
-                                    data = fd.getvalue()
-                                self.__download_progress_bar.reset()
-                                pixmap = QtGui.QPixmap()
-                                pixmap.loadFromData(QtCore.QByteArray(data))
-                                scaled_pixmap = pixmap.scaled(
-                                    self.__picture_view_label.size(),
-                                    QtCore.Qt.KeepAspectRatio,
-                                    QtCore.Qt.SmoothTransformation
-                                )
-                                self.__picture_view_label.setPixmap(scaled_pixmap)
-                except:
-                    pass
-            self.download_task = None
+    def __download_progress_callback(self, downloaded, content_length):
+        if content_length:
+            self.__download_progress_bar.setValue(int(downloaded * 100 / content_length))
+
+    async def download_picture(self, url, show=True):
+        if show:
+            self.__shown_url = url
+
+        def progress_callback(downloaded, content_length):
+            if url == self.__shown_url:
+                self.__download_progress_callback(downloaded, content_length)
+
+        try:
+            # shielded: the download is shared with the other requests of
+            # the same url
+            path = await asyncio.shield(
+                self.__download_manager.download(url, PRIORITY_PREVIEW, progress_callback)
+            )
+        except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+            logger.error("picture download failed: %s" % (str(e),))
+            return
+        if url == self.__shown_url:
+            self.__download_progress_bar.reset()
+        if path is None:
+            return
+        logger.info("picture saved to %s" % (path,))
+        name = os.path.basename(path)
+        data = await asyncio.get_event_loop().run_in_executor(None, read_file, path)
+        self.__picture_cache.put(name, data)
+        if name in self.__picture_history:
+            # some cameras give the same url to every shot
+            self.__picture_history.remove(name)
+        self.__picture_history.append(name)
+        del self.__picture_history[:-PICTURE_HISTORY_SIZE]
+        if show and url == self.__shown_url:
+            self.__history_index = len(self.__picture_history) - 1
+            await self.__show_picture(name)
+        else:
+            self.__update_history_label()
+
+    def __update_history_label(self):
+        if self.__shown_picture in self.__picture_history:
+            self.__history_index = self.__picture_history.index(self.__shown_picture)
+        self.__history_label.setText("%s (%d / %d)" % (
+            self.__shown_picture or "", self.__history_index + 1, len(self.__picture_history)
+        ))
+
+    async def __show_picture(self, name):
+        """Shows a picture of the history, scaled to the picture view. The
+        renditions and the compressed data come from the picture cache"""
+        self.__shown_picture = name
+        self.__update_history_label()
+        size = self.__picture_view_label.size()
+        size_key = (size.width(), size.height())
+        pixmap = self.__picture_cache.get_rendition(name, size_key)
+        if pixmap is None:
+            data = await self.__picture_cache.fetch(name)
+            if data is None:
+                logger.error("picture %s is not available anymore" % (name,))
+                return
+            image = await asyncio.get_event_loop().run_in_executor(None, decode_image, data, size)
+            pixmap = QtGui.QPixmap.fromImage(image)
+            # 32 bits per pixel
+            pixmap_size = pixmap.width() * pixmap.height() * 4
+            self.__picture_cache.put_rendition(name, size_key, pixmap, pixmap_size)
+        # another picture may have been asked for meanwhile
+        if self.__shown_picture == name:
+            self.__picture_view_label.setPixmap(pixmap)
+
+    def __browse_pictures(self, step):
+        index = self.__history_index + step
+        if 0 <= index < len(self.__picture_history):
+            self.__history_index = index
+            asyncio.ensure_future(self.__show_picture(self.__picture_history[index]))
+
+    def __render_shown_picture(self):
+        self.__resize_handle = None
+        if self.__shown_picture is not None:
+            asyncio.ensure_future(self.__show_picture(self.__shown_picture))
+
+    def resizeEvent(self, event):
+        QtWidgets.QMainWindow.resizeEvent(self, event)
+        if self.__resize_handle is not None:
+            self.__resize_handle.cancel()
+        self.__resize_handle = asyncio.get_event_loop().call_later(
+            RESIZE_DELAY,
+            self.__render_shown_picture
+        )
 
     def __init_menu_bar(self):
         menubar = self.menuBar()
 
+        self.__record_liveview_action = QtWidgets.QAction("Record liveview", self)
+        self.__record_liveview_action.setCheckable(True)
+
+        dump_rpc_trace_action = QtWidgets.QAction("Dump RPC trace", self)
+        dump_rpc_trace_action.triggered.connect(self.__dump_rpc_trace)
+
         quit_action = QtWidgets.QAction("Quit", self)
         quit_action.triggered.connect(self.close)
 
         file_ = menubar.addMenu("File")
+        file_.addAction(self.__record_liveview_action)
+        file_.addAction(dump_rpc_trace_action)
         file_.addAction(quit_action)
 
+    def __dump_rpc_trace(self):
+        if self.camera_api is not None and self.camera_api.get_rpc_trace() is not None:
+            self.camera_api.get_rpc_trace().dump(logger, logging.INFO)
+
     def __init_ui(self):
         self.setWindowTitle("Remote control for Sony Cameras")
         self.__init_menu_bar()
@@ -482,7 +672,9 @@ class CameraRemote(QtWidgets.QMainWindow):
         self.__status_label.setAlignment(QtCore.Qt.AlignLeft)
         self.__download_progress_bar = QtWidgets.QProgressBar()
         self.__download_progress_bar.setRange(0, 100)
+        self.__liveview_drop_label = QtWidgets.QLabel()
         self.statusBar().addPermanentWidget(self.__status_label, 1)
+        self.statusBar().addPermanentWidget(self.__liveview_drop_label)
         self.statusBar().addPermanentWidget(self.__download_progress_bar, 1)
 
         # x and y coordinates on the screen, width, height
@@ -535,8 +727,24 @@ class CameraRemote(QtWidgets.QMainWindow):
         self.__picture_view_label = QtWidgets.QLabel()
         self.__picture_view_label.setAlignment(QtCore.Qt.AlignTop)
         self.__picture_view_label.setMargin(0)
-        picture_view_layout = QtWidgets.QHBoxLayout()
-        picture_view_layout.addWidget(self.__picture_view_label)
+        # the pixmap follows the size of the view, not the other way round
+        self.__picture_view_label.setSizePolicy(
+            QtWidgets.QSizePolicy.Ignored,
+            QtWidgets.QSizePolicy.Ignored
+        )
+        previous_button = QtWidgets.QPushButton("Previous")
+        previous_button.clicked.connect(lambda: self.__browse_pictures(-1))
+        next_button = QtWidgets.QPushButton("Next")
+        next_button.clicked.connect(lambda: self.__browse_pictures(1))
+        self.__history_label = QtWidgets.QLabel()
+        self.__history_label.setAlignment(QtCore.Qt.AlignCenter)
+        history_layout = QtWidgets.QHBoxLayout()
+        history_layout.addWidget(previous_button)
+        history_layout.addWidget(self.__history_label, 1)
+        history_layout.addWidget(next_button)
+        picture_view_layout = QtWidgets.QVBoxLayout()
+        picture_view_layout.addWidget(self.__picture_view_label, 1)
+        picture_view_layout.addLayout(history_layout)
         picture_view_layout.setContentsMargins(0, 0, 0, 0)
         picture_view_widget = QtWidgets.QWidget()
         picture_view_widget.setLayout(picture_view_layout)
@@ -568,39 +776,73 @@ class CameraRemote(QtWidgets.QMainWindow):
 
     def closeEvent(self, event):
         if self.__closing_actions:
-            if self.download_task is not None:
-                self.download_task.cancel()
+            if self.__download_manager is not None:
+                self.__download_manager.close()
+            logger.info("picture cache stats: %s" % (self.__picture_cache.get_stats(),))
             if self.liveview_task is not None:
                 self.liveview_task.cancel()
+            if self.__burst_downloader is not None:
+                self.__burst_downloader.close()
+            logger.info("http pool stats: %s" % (self.camera_api.get_http_pool().get_stats(),))
             self.camera_api.close()
             logger.info("finished")
         else:
             if self.camera_api is not None:
-                stop_future = asyncio.ensure_future(self.camera_api.stopRecMode())
+                # the evicted pictures are still being written meanwhile
+                stop_future = asyncio.ensure_future(asyncio.gather(
+                    self.camera_api.stopRecMode(), self.__picture_cache.join()
+                ))
                 stop_future.add_done_callback(self.__pre_close_callback)
                 event.ignore()
             else:
                 logger.info("finished")
 
 
-app = QtWidgets.QApplication(sys.argv)
-loop = QEventLoop(app)
-loop.set_debug(False)
-asyncio.set_event_loop(loop)
-
-camera_remote = CameraRemote()
-camera_remote.show()
-
-logger = logging.getLogger("cameraremote")
-file_handler = logging.FileHandler(filename="cameraremote.log", mode='w')
-formatter = logging.Formatter("%(levelname)-8s %(message)s")
-file_handler.setFormatter(formatter)
-logger.addHandler(file_handler)
-logger.setLevel(logging.DEBUG)
-logger.info("started")
-
-try:
-    sys.exit(app.exec_())
-finally:
-    loop.close()
-    file_handler.close()
+def main():
+    parser = argparse.ArgumentParser(description="Remote control for Sony cameras")
+    parser.add_argument("--metrics-port", type=int,
+                        help="serve the metrics on http://127.0.0.1:PORT/metrics")
+    parser.add_argument("--debug", action="store_true")
+    parser.add_argument("--endpoint", help="camera service url, skips the discovery")
+    parser.add_argument("--picture-cache-size", type=int, default=DEFAULT_MAX_BYTES // (1024 * 1024),
+                        help="memory used by the pictures browsed in the picture view (MiB)")
+    parser.add_argument("--record-session", metavar="PATH",
+                        help="append the requests and responses to a session file (see rpcsession.py)")
+    # the other arguments are left to Qt
+    args, qt_args = parser.parse_known_args()
+
+    app = QtWidgets.QApplication(sys.argv[:1] + qt_args)
+    loop = QEventLoop(app)
+    loop.set_debug(False)
+    asyncio.set_event_loop(loop)
+    if args.metrics_port is not None:
+        asyncio.ensure_future(start_metrics_server(port=args.metrics_port))
+
+    file_handler = logging.FileHandler(filename="cameraremote.log", mode='w')
+    formatter = logging.Formatter("%(levelname)-8s %(message)s")
+    file_handler.setFormatter(formatter)
+    logger.addHandler(file_handler)
+    logger.setLevel(logging.DEBUG if args.debug else logging.INFO)
+    logger.info("started")
+
+    session_recorder = None
+    if args.record_session is not None:
+        session_recorder = RpcSessionRecorder(args.record_session)
+    camera_remote = CameraRemote(
+        endpoint_url=args.endpoint,
+        session_recorder=session_recorder,
+        picture_cache_size=args.picture_cache_size * 1024 * 1024
+    )
+    camera_remote.show()
+
+    try:
+        sys.exit(app.exec_())
+    finally:
+        loop.close()
+        if session_recorder is not None:
+            session_recorder.close()
+        file_handler.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -2,11 +2,17 @@
 
 import aiohttp
 import asyncio
+from capabilities import CapabilityIndex
 from distutils.version import StrictVersion
 from functools import partial
+from httppool import HttpPool
 import json
 import logging
-from utils import upper_first_letter
+from methodversioncache import MethodVersionCache
+from metrics import REGISTRY
+from rpctrace import RPC_TRACE_SIZE, RpcTrace
+import time
+from utils import candidate_range, lower_first_letter, upper_first_letter
 
 # from utils import debug_trace
 
@@ -24,6 +30,10 @@ class CameraRemoteEventWatcher(object):
     def __init__(self, camera_remote_api):
         self.__camera_remote_api = camera_remote_api
         self.__event_watcher_future = None
+        # last data dispatched for each event and events whose callback is
+        # called even when their data did not change
+        self.__last_data = {}
+        self.__full_dispatch_events = set()
 
         self.__registered_events = {
             "cameraStatus": None,
@@ -76,15 +86,26 @@ class CameraRemoteEventWatcher(object):
             "windNoiseReduction": None,
         }
 
-    def register_events(self, watched_events):
+    def get_event_names(self):
+        return list(self.__registered_events)
+
+    def register_events(self, watched_events, full_dispatch=False):
+        """Registers event callbacks. A callback is only called when the data
+        of its event changes, unless full_dispatch is True"""
         for event_name, event_callback in watched_events.items():
             if event_name in self.__registered_events:
                 self.__registered_events[event_name] = event_callback
+                self.__last_data.pop(event_name, None)
+                if full_dispatch:
+                    self.__full_dispatch_events.add(event_name)
+                else:
+                    self.__full_dispatch_events.discard(event_name)
             else:
                 raise CameraRemoteException("unknwon event name %s" % (event_name))
 
     def __process_dict_item(self, item):
         event_name = item["type"]
+        REGISTRY.inc("events_total", labels={"type": event_name})
         try:
             event_callback = self.__registered_events[event_name]
         except KeyError as e:
@@ -105,32 +126,39 @@ class CameraRemoteEventWatcher(object):
                     min_ = item["min" + capitalized_event_name]
                     max_ = item["max" + capitalized_event_name]
                     step = item["stepIndexOf" + capitalized_event_name]
-                    value = min_
-                    candidates = []
-                    while value <= max_:
-                        candidates.append(str(value))
-                        value += step
-                    data["Candidates"] = candidates
+                    data["Candidates"] = candidate_range(event_name, min_, max_, step)
                 except KeyError:
                     return
         else:
             data = item
+        if event_name not in self.__full_dispatch_events:
+            if self.__last_data.get(event_name) == data:
+                return
+            self.__last_data[event_name] = data
         event_callback(data)
 
+    def process_event_result(self, result):
+        """Dispatches the result of a getEvent call to the callbacks. The
+        callbacks must not block: the next events are polled afterwards"""
+        if result[0] is not None:
+            available_api_list = result[0]["names"]
+            self.__camera_remote_api.set_available_api_list(available_api_list)
+
+        for item in result[1:]:
+            if type(item) == dict:
+                self.__process_dict_item(item)
+            if type(item) == list:
+                for litem in item:
+                    self.__process_dict_item(litem)
+
     async def __watcher(self):
         long_polling_flag = False
         while True:
+            start = time.perf_counter()
             result = await self.__camera_remote_api.getEvent(None, longPollingFlag=long_polling_flag)
-            if result[0] is not None:
-                available_api_list = result[0]["names"]
-                self.__camera_remote_api.set_available_api_list(available_api_list)
-
-            for item in result[1:]:
-                if type(item) == dict:
-                    self.__process_dict_item(item)
-                if type(item) == list:
-                    for litem in item:
-                        self.__process_dict_item(litem)
+            if long_polling_flag:
+                REGISTRY.observe("event_long_poll_seconds", time.perf_counter() - start)
+            self.process_event_result(result)
             long_polling_flag = True
 
     def __end_watcher(self, f):
@@ -139,6 +167,7 @@ class CameraRemoteEventWatcher(object):
             logger.error("watcher event loop stopped unexpectedly, reason: %s" % (str(exception),))
 
     def start_event_watcher(self):
+        self.__last_data.clear()
         self.__event_watcher_future = asyncio.ensure_future(self.__watcher())
         self.__event_watcher_future.add_done_callback(self.__end_watcher)
 
@@ -147,19 +176,125 @@ class CameraRemoteEventWatcher(object):
             self.__event_watcher_future.cancel()
 
 
+class UnavailableMethodStub(object):
+    """Stub of the methods which are not available : fail silently"""
+
+    async def __call__(self, *args, **kwargs):
+        return None
+
+    def prepare(self, *args, **kwargs):
+        return self
+
+
+unavailable_method = UnavailableMethodStub()
+
+
+class MethodStub(object):
+    """Callable sending one api method
+
+    Everything which does not depend on the call (parameter validators,
+    json request template, connection purpose) is prepared once.
+    """
+
+    def __init__(self, send, name, method, validators):
+        self.__send = send
+        self.name = name
+        self.__params = tuple(method["params"])
+        self.__validators = [
+            (param_name, validators.get(param_name)) for param_name in self.__params
+        ]
+        self.__params_set = frozenset(self.__params)
+        self.available_api_list_changed = method.get("available_api_list_changed", False)
+        self.purpose = "event" if name == "getEvent" else "rpc"
+        self.metrics_labels = {"method": name}
+        # params and id are filled for each call
+        self.template = '{"method": %s, "params": %%s, "id": %%d, "version": %s}' % \
+            (json.dumps(name), json.dumps(method["version"]))
+
+    async def __call__(self, *args, **kwargs):
+        return await self.prepare(*args, **kwargs)()
+
+    def prepare(self, *args, **kwargs):
+        """Checks the parameters and returns a coroutine function sending the
+        request, for sending it later with as little work as possible. Its
+        optional sent_callback() is called right before the request is
+        written"""
+        # checks param numbers
+        args_len = len(args)
+        if args_len > 1:
+            logger.error("%d parameters for %s method" % (args_len, self.name))
+            raise CameraRemoteException("wrong number of parameters")
+        if kwargs:
+            if len(kwargs) > len(self.__params):
+                logger.error("%d keyword parameters for %s method" % (len(kwargs), self.name))
+                raise CameraRemoteException("wrong number of keyword parameters")
+            # check param names (enables optional parameters)
+            for param_name in kwargs:
+                if param_name not in self.__params_set:
+                    raise Exception("\"%s\" : unknown parameter" % (param_name,))
+
+        # check param values and fill the query "params" value
+        param_items = []
+        for param_name, validator in self.__validators:
+            param_value = kwargs[param_name]
+            if validator is not None:
+                validator(param_value)
+            param_items.append(param_value)
+
+        # the optional positional parameter is the timeout
+        return partial(self.__send, self, param_items, args)
+
+
+def make_value_validator(values):
+    values = frozenset(values)
+
+    def validator(value):
+        if value not in values:
+            raise ValueError("\"%s\" : unknown value" % (value,))
+    return validator
+
+
+def make_type_validator(type_):
+    def validator(value):
+        if type(value) != type_:
+            raise ValueError("\"%s\" : wrong type" % (value,))
+    return validator
+
+
 class CameraRemoteApi(object):
 
     SERVICE_NAME = "camera"
 
-    def __init__(self, endpoint_url, loop):
+    def __init__(self, endpoint_url, loop, http_pool_limits=None, method_version_cache=None,
+                 rpc_trace_size=RPC_TRACE_SIZE, session_recorder=None, http_pool=None):
         self.__endpoint_url = endpoint_url
-        self.__session = aiohttp.ClientSession(loop=loop)
+        # http_pool replaces the HttpPool of the camera, for instance by a
+        # fake transport
+        if http_pool is None:
+            http_pool = HttpPool(loop, http_pool_limits)
+        self.__http_pool = http_pool
+        if method_version_cache is None:
+            method_version_cache = MethodVersionCache()
+        self.__method_version_cache = method_version_cache
+        # no trace when its size is 0
+        self.__rpc_trace = RpcTrace(rpc_trace_size) if rpc_trace_size else None
+        # rpcsession.RpcSessionRecorder capturing the requests and responses
+        self.__session_recorder = session_recorder
 
         self.__request_id = 1
+        # requests sent and not answered yet, id -> method name
+        self.__in_flight = {}
         self.__timeout = 5
         self.__global_api_version_ok = False
-        # solve the chicken and egg problem
-        self.__available_api_list = ["getAvailableApiList"]
+        # solve the chicken and egg problem: the server information methods
+        # are always available
+        self.__capabilities = CapabilityIndex([
+            "getAvailableApiList",
+            "getApplicationInfo",
+            "getVersions",
+            "getMethodTypes",
+        ])
+        self.__capabilities.subscribe(self.__capabilities_changed)
         self.__events_watcher = CameraRemoteEventWatcher(self)
 
         self.__METHODS = {
@@ -194,7 +329,7 @@ class CameraRemoteApi(object):
                 "params": [],
                 "version": "1.0"
             },
-            "stoptContShooting": {
+            "stopContShooting": {
                 "params": [],
                 "version": "1.0"
             },
@@ -232,11 +367,11 @@ class CameraRemoteApi(object):
                 "version": "1.0"
             },
             "getSupportedLiveviewSize": {
-                "params": ["liveviewSize"],
+                "params": [],
                 "version": "1.0"
             },
             "getAvailableLiveviewSize": {
-                "params": ["liveviewSize"],
+                "params": [],
                 "version": "1.0"
             },
 
@@ -467,11 +602,11 @@ class CameraRemoteApi(object):
                 "version": "1.0"
             },
             "getSupportedPostviewImageSize": {
-                "params": ["postviewImageSize"],
+                "params": [],
                 "version": "1.0"
             },
             "getAvailablePostviewImageSize": {
-                "params": ["postviewImageSize"],
+                "params": [],
                 "version": "1.0"
             },
 
@@ -584,140 +719,256 @@ class CameraRemoteApi(object):
             "apiVersion": str,
         }
 
+        self.__validators = {}
+        for param_name, type_ in self.__TYPES.items():
+            self.__validators[param_name] = make_type_validator(type_)
+        for param_name, values in self.__PARAMS.items():
+            self.__validators[param_name] = make_value_validator(values)
+
     async def __get_available_api_list(self):
         result = await self.getAvailableApiList()
-        self.__available_api_list = result[0]
+        self.set_available_api_list(result[0])
 
     def set_available_api_list(self, available_api_list):
-        self.__available_api_list = available_api_list
+        added, removed = self.__capabilities.update(available_api_list)
+        if added or removed:
+            logger.debug("available api list version %d, added: %s, removed: %s" %
+                         (self.__capabilities.get_version(), sorted(added), sorted(removed)))
+
+    def __capabilities_changed(self, capabilities, added, removed):
+        self.__drop_method_stubs(added | removed)
+
+    def get_capabilities(self):
+        """Returns the index of the available methods, subscribe to it to be
+        notified of the changes"""
+        return self.__capabilities
 
     def is_method_available(self, method):
         """Checks if a method is currently available"""
-        return method in self.__available_api_list
+        return method in self.__capabilities
 
-    async def initial_checks(self):
-        """Perform initial ckecks"""
-        # get initial available api list
-        await self.__get_available_api_list()
+    async def initial_checks(self, model=None):
+        """Perform initial ckecks
+
+        The server information calls are sent together. The method versions
+        resolved from getMethodTypes are cached by model, application and
+        api version: getMethodTypes is skipped for a known camera. The cache
+        is not used when the model is unknown.
+        """
+        result = await self.batch("getAvailableApiList", "getApplicationInfo", "getVersions")
+        available_api_list, application_info, versions = result
+        self.set_available_api_list(available_api_list[0])
 
         # check global api version
-        result = await self.getApplicationInfo()
-        api_version_str = result[1]
+        application_name, api_version_str = application_info[:2]
         self.__global_api_version_ok = \
             StrictVersion(api_version_str) >= StrictVersion(MINIMUM_API_VERSION)
-        logger.info("Api name: " + result[0] + ", Api version: " + api_version_str)
+        logger.info("Api name: " + application_name + ", Api version: " + api_version_str)
         logger.debug("Api version OK ? " + str(self.__global_api_version_ok))
 
-        # update method versions
-        result = await self.getVersions()
         # get highest supported api version
-        api_version = sorted(result[0], key=StrictVersion)[-1]
+        api_version = sorted(versions[0], key=StrictVersion)[-1]
         logger.info("api version chosen: %s" % (api_version,))
-        result = await self.getMethodTypes(apiVersion=api_version)
-        for method_list in result:
+
+        # update method versions
+        cache_key = MethodVersionCache.make_key(model, application_name, api_version_str, api_version)
+        method_versions = None
+        # a recorded session must be replayable without the cache
+        if model is not None and self.__session_recorder is None:
+            method_versions = self.__method_version_cache.get(cache_key)
+        if method_versions is None:
+            result = await self.getMethodTypes(apiVersion=api_version)
+            method_versions = self.__resolve_method_versions(result)
+            if model is not None:
+                self.__method_version_cache.update(cache_key, method_versions)
+        else:
+            logger.debug("method versions found in cache for %s" % (cache_key,))
+        for method_name, version in method_versions.items():
+            if method_name in self.__METHODS and self.__METHODS[method_name]["version"] != version:
+                logger.debug("updating %s method version : %s -> %s" %
+                             (method_name, self.__METHODS[method_name]["version"], version))
+                self.__METHODS[method_name]["version"] = version
+                self.__drop_method_stubs([method_name])
+        return self.__events_watcher
+
+    def __resolve_method_versions(self, method_types):
+        """Returns the highest version of each known method"""
+        method_versions = {}
+        for method_list in method_types:
             method_name = method_list[0]
             new_version = method_list[-1]
             try:
-                current_version = self.__METHODS[method_name]["version"]
+                current_version = method_versions.get(method_name, self.__METHODS[method_name]["version"])
             except KeyError:
                 logger.error("unknown %s method" % (method_name,))
                 continue
             if StrictVersion(new_version) > StrictVersion(current_version):
-                self.__METHODS[method_name]["version"] = new_version
-                logger.debug("updating %s method version : %s -> %s" %
-                          (method_name, current_version, new_version))
+                method_versions[method_name] = new_version
+        return method_versions
+
+    def get_events_watcher(self):
         return self.__events_watcher
 
+    def get_http_pool(self):
+        """Returns the http connections pool shared by all the requests made
+        to the camera (rpc, liveview, downloads)"""
+        return self.__http_pool
+
+    def get_rpc_trace(self):
+        """Returns the RpcTrace of the last requests, None if disabled"""
+        return self.__rpc_trace
+
+    def get_in_flight_count(self):
+        """Returns the number of requests waiting for their response"""
+        return len(self.__in_flight)
+
+    async def batch(self, *calls, return_exceptions=False):
+        """Sends several requests at once and returns their results in order
+
+        Each call is a method name or a (method name, keyword parameters)
+        tuple. The requests are concurrent within the "rpc" connections of
+        the http pool: a batch costs about one round trip per that many
+        calls. With return_exceptions, a failed call gives its exception
+        instead of aborting the batch.
+        """
+        coroutines = []
+        for call in calls:
+            if isinstance(call, str):
+                name, kwargs = call, {}
+            else:
+                name, kwargs = call
+            coroutines.append(getattr(self, name)(**kwargs))
+        return await asyncio.gather(*coroutines, return_exceptions=return_exceptions)
+
+    async def get_available_values(self):
+        """Calls all the available getAvailable* methods in one batch
+
+        Returns a dictionary whose keys are the parameter names (for
+        instance "fNumber" for getAvailableFNumber) and values the results.
+        Failed calls are logged and left out.
+        """
+        names = [
+            name for name in self.__METHODS
+            if name.startswith("getAvailable") and name != "getAvailableApiList" and
+            self.is_method_available(name)
+        ]
+        results = await self.batch(*names, return_exceptions=True)
+        available_values = {}
+        for name, result in zip(names, results):
+            if isinstance(result, Exception):
+                logger.error("%s failed: %s" % (name, str(result)))
+            elif result is not None:
+                available_values[lower_first_letter(name[len("getAvailable"):])] = result
+        return available_values
+
     def set_default_timeout(self, timeout):
         self.__timeout = timeout
 
     def __getattr__(self, name):
-        """Used for getting api methods"""
+        """Used for getting api methods
+
+        The method stub is compiled once and cached as an instance attribute,
+        next accesses do not go through __getattr__ anymore. It is dropped
+        when the method availability or version changes.
+        """
+        if name.startswith("_"):
+            raise AttributeError(name)
         error_msg = ""
-        if name not in self.__available_api_list:
+        if name not in self.__capabilities:
             error_msg = "method %s not in available api list" % (name,)
         elif name not in self.__METHODS:
             error_msg = "unknown %s method" % (name,)
         if error_msg != "":
             logger.error(error_msg)
-            name = None
-        return partial(self.__trunk, name)
-
-    async def __get_response(self, data, headers):
-        logger.debug("called > %s" % (data,))
-        try:
-            response = await self.__session.post(self.__endpoint_url,
-                                                 data=data.encode("ascii"),
-                                                 headers=headers)
+            stub = unavailable_method
+        else:
+            stub = MethodStub(self.__send, name, self.__METHODS[name], self.__validators)
+        self.__dict__[name] = stub
+        return stub
+
+    def __drop_method_stubs(self, names):
+        for name in names:
+            self.__dict__.pop(name, None)
+
+    async def __get_response(self, data, headers, purpose, sent_callback):
+        """Posts a request and returns the raw body of the response"""
+        if self.__session_recorder is not None:
+            start = time.perf_counter()
+        async with self.__http_pool.post(purpose,
+                                         self.__endpoint_url,
+                                         data=data.encode("ascii"),
+                                         headers=headers,
+                                         sent_callback=sent_callback) as response:
             if response.status == 200:
-                resp = await response.json()
-                logger.debug("received < %s" % (resp,))
+                body = await response.read()
             else:
                 raise CameraRemoteException("http error %d" % (response.status,))
-        finally:
-            response.release()
-        return resp
+        if self.__session_recorder is not None:
+            self.__session_recorder.record(start, time.perf_counter() - start, purpose, data, body)
+        return body
 
-    async def __trunk(self, name, *args, **kwargs):
-        if name is None:
-            # the method is not available : fail silently
-            return None
-        method = self.__METHODS[name]
-        params = method["params"]
-
-        # checks param numbers
-        timeout = self.__timeout
-        args_len = len(args)
-        if 0 <= args_len <= 1:
-            if args_len == 1:
-                timeout = args[0]
-        else:
-            logger.error("%d parameters for %s method" % (args_len, name))
-            raise CameraRemoteException("wrong number of parameters")
-        kwargs_len = len(kwargs)
-        if kwargs_len > len(params):
-            logger.error("%d keyword parameters for %s method" % (kwargs_len, name))
-            raise CameraRemoteException("wrong number of keyword parameters")
-
-        # param checks
-        for param_name, param_value in kwargs.items():
-            # check param name (enables optional parameters)
-            if param_name not in params:
-                raise Exception("\"%s\" : unknown parameter" % (param_name,))
-            # check param value
-            if param_name in self.__PARAMS:
-                if param_value not in self.__PARAMS[param_name]:
-                    raise ValueError("\"%s\" : unknown value" % (param_value,))
-            elif param_name in self.__TYPES:
-                if type(param_value) != self.__TYPES[param_name]:
-                    raise ValueError("\"%s\" : wrong type" % (param_value,))
-        # fill the query "params" value
-        param_items = []
-        for param_name in params:
-            param_items.append(kwargs[param_name])
-
-        data = {
-            "method": name,
-            "params": param_items,
-            "id": self.__request_id,
-            "version": method["version"]
-        }
+    async def __send(self, stub, param_items, args, sent_callback=None):
+        timeout = args[0] if args else self.__timeout
         req_id = self.__request_id
         self.__request_id += 1
 
-        data_json = json.dumps(data)
+        data_json = stub.template % (json.dumps(param_items), req_id)
         headers = {'content-type': 'application/json'}
-        if timeout is None:
-            resp = await self.__get_response(data_json, headers)
-        else:
-            with aiohttp.Timeout(timeout):
-                resp = await self.__get_response(data_json, headers)
-
-        if resp["id"] != req_id:
+        self.__in_flight[req_id] = stub.name
+        REGISTRY.add("rpc_in_flight", 1)
+        body = None
+        outcome = "ok"
+        # the trace is dumped on timeouts and transport errors, not on the
+        # errors returned by the camera
+        dump_trace = False
+        start = time.perf_counter()
+        try:
+            if timeout is None:
+                body = await self.__get_response(data_json, headers, stub.purpose,
+                                                 sent_callback)
+            else:
+                with aiohttp.Timeout(timeout):
+                    body = await self.__get_response(data_json, headers, stub.purpose,
+                                                     sent_callback)
+            resp = json.loads(body.decode("utf-8"))
+            # several requests may be in flight, the answer must match this one
+            if resp.get("id") != req_id:
+                outcome = "bad id %s" % (resp.get("id"),)
+            elif "error" in resp:
+                outcome = resp["error"][1]
+        except asyncio.TimeoutError:
+            outcome = "timeout"
+            dump_trace = True
+            REGISTRY.inc("rpc_timeouts_total", labels=stub.metrics_labels)
+            raise
+        except asyncio.CancelledError:
+            # not an Exception since python 3.8
+            outcome = "cancelled"
+            raise
+        except Exception as e:
+            outcome = str(e)
+            dump_trace = True
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            del self.__in_flight[req_id]
+            REGISTRY.add("rpc_in_flight", -1)
+            REGISTRY.observe("rpc_latency_seconds", duration, stub.metrics_labels)
+            if outcome not in ("ok", "timeout", "cancelled"):
+                REGISTRY.inc("rpc_errors_total", labels=stub.metrics_labels)
+            if self.__rpc_trace is not None:
+                self.__rpc_trace.record(stub.name, req_id, start, duration, len(data_json),
+                                        len(body) if body is not None else None, outcome)
+                if dump_trace:
+                    self.__rpc_trace.dump(logger)
+
+        if resp.get("id") != req_id:
+            logger.error("response id %s for %s request %d, in flight: %s" %
+                         (resp.get("id"), stub.name, req_id, self.__in_flight))
             raise CameraRemoteException("bad id")
 
         if "result" in resp or "results" in resp:
-            if method.get("available_api_list_changed", False):
+            if stub.available_api_list_changed:
                 await self.__get_available_api_list()
             if "result" in resp:
                 return resp["result"]
@@ -732,4 +983,4 @@ class CameraRemoteApi(object):
     def close(self):
         if self.__events_watcher is not None:
             self.__events_watcher.stop_event_watcher()
-        self.__session.close()
+        self.__http_pool.close()
@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import time
+START_TIME = time.perf_counter()
+
+import aiohttp
+import argparse
+import asyncio
+from collections import OrderedDict
+import logging
+import os
+import sys
+import urllib.parse
+
+from burstdownloader import BurstDownloader
+from camerafleet import CameraFleet
+from cameraremoteapi import CameraRemoteApi
+from download import save_picture
+from downloadmanager import DownloadManager
+from endpointcache import EndpointCache
+from intervalshooting import IntervalShooter
+from liveview import LiveviewStreamReader
+from liveviewrecorder import LiveviewRecorder
+from metrics import start_metrics_server
+from rpcsession import RpcSessionRecorder
+
+logger = logging.getLogger("cameraremote")
+
+# period of the glib main context iterations during discovery (seconds)
+GLIB_POLL_INTERVAL = 0.05
+
+# maximum wait for the camera to be idle after a burst (seconds)
+BURST_END_TIMEOUT = 10
+
+
+async def pump_glib():
+    """Runs the glib main context from the asyncio loop: GUPnP signals
+    are emitted by glib (the Qt event loop does it for the gui)"""
+    from gi.repository import GLib
+    context = GLib.MainContext.default()
+    while True:
+        while context.iteration(False):
+            pass
+        await asyncio.sleep(GLIB_POLL_INTERVAL)
+
+
+async def discover(friendly_name, timeout, all_devices=False):
+    """Returns the (endpoint url, device name) pairs of the cameras found:
+    the first one or, with all_devices, all those found before timeout"""
+    # gi and GUPnP are only needed when the endpoint is not given
+    from cameraremotecontrol import CameraRemoteControl
+
+    cameras = OrderedDict()
+    found = asyncio.Future()
+
+    async def device_available_callback(device_name, endpoint_url):
+        logger.info("device %s found at %s" % (device_name, endpoint_url))
+        cameras.setdefault(endpoint_url, device_name)
+        if not all_devices and not found.done():
+            found.set_result(None)
+
+    # keep a reference to the control point while discovering
+    control = CameraRemoteControl(friendly_name, device_available_callback, EndpointCache())
+    pump_task = asyncio.ensure_future(pump_glib())
+    try:
+        await asyncio.wait_for(found, timeout)
+    except asyncio.TimeoutError:
+        if not cameras:
+            raise
+    finally:
+        pump_task.cancel()
+        control.cp.set_active(False)
+    return list(cameras.items())
+
+
+async def info_command(camera_api, events_watcher, args):
+    result = await camera_api.batch("getApplicationInfo", "getVersions", "getAvailableApiList")
+    print("application: %s %s" % tuple(result[0][:2]))
+    print("api versions: %s" % (", ".join(result[1][0]),))
+    print("available api: %s" % (", ".join(sorted(result[2][0])),))
+
+
+async def take_picture_command(camera_api, events_watcher, args):
+    http_pool = camera_api.get_http_pool()
+    for _ in range(args.count):
+        result = await camera_api.actTakePicture()
+        for url in result[0]:
+            path = await save_picture(http_pool, url, args.directory)
+            if path is not None:
+                print(path)
+
+
+async def burst_command(camera_api, events_watcher, args):
+    download_manager = DownloadManager(camera_api.get_http_pool(), args.directory, args.workers)
+    downloader = BurstDownloader(download_manager, args.workers, callback=print)
+    idle = asyncio.Event()
+
+    def camera_status_callback(data):
+        if data["cameraStatus"] == "IDLE":
+            idle.set()
+        else:
+            idle.clear()
+
+    # the same url coming twice during the burst is dropped by the downloader
+    events_watcher.register_events(downloader.get_event_callbacks(), full_dispatch=True)
+    events_watcher.register_events({"cameraStatus": camera_status_callback})
+    download_manager.start()
+    downloader.start()
+    events_watcher.start_event_watcher()
+    try:
+        downloader.start_burst()
+        await camera_api.startContShooting()
+        await asyncio.sleep(args.duration)
+        # the last urls come with the events following the end of the burst
+        idle.clear()
+        await camera_api.stopContShooting()
+        try:
+            await asyncio.wait_for(idle.wait(), BURST_END_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning("camera still busy %d s after the burst" % (BURST_END_TIMEOUT,))
+        await downloader.join()
+    finally:
+        events_watcher.stop_event_watcher()
+        downloader.close()
+        download_manager.close()
+    print("burst: %s" % (downloader.get_stats(),))
+
+
+async def timelapse_command(camera_api, events_watcher, args):
+    directory = None if args.no_download else args.directory
+    shooter = IntervalShooter(camera_api, args.interval, args.count, directory)
+    try:
+        await shooter.run()
+    finally:
+        summary = shooter.get_stats().get_summary()
+        print("%d shots, %d missed slots, %d failed, %d downloaded" % (
+            summary["shots"], summary["missed_slots"], summary["failed_shots"], summary["downloads"]
+        ))
+        if summary["shots"]:
+            print("trigger jitter: mean %.1f ms, p95 %.1f ms, max %.1f ms" % (
+                summary["mean_jitter"] * 1000, summary["p95_jitter"] * 1000, summary["max_jitter"] * 1000
+            ))
+
+
+async def events_command(camera_api, events_watcher, args):
+    def print_event(event_name):
+        return lambda data: print("%s: %s" % (event_name, data))
+
+    events_watcher.register_events(
+        {event_name: print_event(event_name) for event_name in events_watcher.get_event_names()},
+        full_dispatch=args.full_dispatch
+    )
+    events_watcher.start_event_watcher()
+    await asyncio.sleep(args.duration)
+
+
+async def liveview_command(camera_api, events_watcher, args):
+    result = await camera_api.startLiveview()
+    recorder = LiveviewRecorder(args.output)
+    frames = 0
+    try:
+        async with camera_api.get_http_pool().get("liveview", result[0]) as resp:
+            with aiohttp.Timeout(args.duration):
+                async for frame in LiveviewStreamReader(resp.content):
+                    recorder.record(frame)
+                    frames += 1
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        recorder.close()
+        await camera_api.stopLiveview()
+    print("%d frames recorded to %s, %d dropped" % (frames - recorder.get_dropped_count(), args.output,
+                                                     recorder.get_dropped_count()))
+
+
+async def fleet_take_picture_command(cameras, args):
+    fleet = CameraFleet()
+    try:
+        await asyncio.gather(*[
+            fleet.add_camera(device_name, endpoint_url) for endpoint_url, device_name in cameras
+        ])
+        http_pools = {
+            endpoint_url: fleet.get_camera_api(endpoint_url).get_http_pool()
+            for endpoint_url, _ in fleet.get_cameras()
+        }
+        for _ in range(args.count):
+            fan_out_result = await fleet.take_picture()
+            downloads = []
+            for endpoint_url, result in fan_out_result.results.items():
+                if endpoint_url in fan_out_result.skews:
+                    print("%s: skew %.3f ms, latency %.1f ms" % (
+                        endpoint_url,
+                        fan_out_result.skews[endpoint_url] * 1000,
+                        fan_out_result.latencies[endpoint_url] * 1000
+                    ))
+                if isinstance(result, Exception):
+                    logger.error("%s: %s" % (endpoint_url, str(result)))
+                elif result is not None:
+                    for url in result[0]:
+                        # cameras of the same model give the same file names
+                        directory = os.path.join(args.directory, urllib.parse.urlparse(endpoint_url).netloc)
+                        downloads.append(save_picture(http_pools[endpoint_url], url, directory))
+            for path in await asyncio.gather(*downloads):
+                if path is not None:
+                    print(path)
+    finally:
+        fleet.close()
+
+
+COMMANDS = {
+    "info": info_command,
+    "take-picture": take_picture_command,
+    "timelapse": timelapse_command,
+    "burst": burst_command,
+    "events": events_command,
+    "liveview": liveview_command,
+}
+
+FLEET_COMMANDS = {
+    "fleet-take-picture": fleet_take_picture_command,
+}
+
+
+async def run(args):
+    if args.metrics_port is not None:
+        metrics_server = await start_metrics_server(port=args.metrics_port)
+    try:
+        await run_command(args)
+    finally:
+        if args.metrics_port is not None:
+            metrics_server.close()
+
+
+async def run_command(args):
+    fleet_command = args.command in FLEET_COMMANDS
+    if args.endpoint is not None:
+        # the model is unknown
+        cameras = [(endpoint_url, None) for endpoint_url in args.endpoint]
+    else:
+        cameras = await discover(args.name, args.discovery_timeout, fleet_command)
+
+    if fleet_command:
+        await FLEET_COMMANDS[args.command](cameras, args)
+        return
+
+    session_recorder = None
+    if args.record_session is not None:
+        session_recorder = RpcSessionRecorder(args.record_session)
+    http_pool_limits = None
+    if getattr(args, "workers", None) is not None:
+        # one download connection per worker
+        http_pool_limits = {"download": args.workers}
+    endpoint_url, device_name = cameras[0]
+    camera_api = CameraRemoteApi(endpoint_url, asyncio.get_event_loop(), http_pool_limits,
+                                 session_recorder=session_recorder)
+    try:
+        events_watcher = await camera_api.initial_checks(device_name)
+        if camera_api.is_method_available("startRecMode"):
+            await camera_api.startRecMode()
+        logger.info("ready %.1f ms after startup" % ((time.perf_counter() - START_TIME) * 1000,))
+        await COMMANDS[args.command](camera_api, events_watcher, args)
+    finally:
+        camera_api.close()
+        if session_recorder is not None:
+            session_recorder.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Headless remote control for Sony cameras")
+    parser.add_argument("--endpoint", action="append",
+                        help="camera service url, skips the discovery (repeat it for a fleet)")
+    parser.add_argument("--name", default="ILCE", help="friendly name prefix of the camera")
+    parser.add_argument("--discovery-timeout", type=float, default=30)
+    parser.add_argument("--debug", action="store_true")
+    parser.add_argument("--metrics-port", type=int,
+                        help="serve the metrics on http://127.0.0.1:PORT/metrics")
+    parser.add_argument("--record-session", metavar="PATH",
+                        help="append the requests and responses to a session file (see rpcsession.py)")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    subparsers.add_parser("info", help="print camera information")
+
+    take_picture = subparsers.add_parser("take-picture", help="shoot and download the postviews")
+    take_picture.add_argument("--count", type=int, default=1)
+    take_picture.add_argument("--directory", default="pictures")
+
+    timelapse = subparsers.add_parser("timelapse", help="shoot at a fixed interval")
+    timelapse.add_argument("--interval", type=float, required=True, help="seconds")
+    timelapse.add_argument("--count", type=int, help="number of shots, endless by default")
+    timelapse.add_argument("--directory", default="pictures")
+    timelapse.add_argument("--no-download", action="store_true", help="do not download the postviews")
+
+    burst = subparsers.add_parser("burst", help="continuous shooting, downloading the pictures meanwhile")
+    burst.add_argument("--duration", type=float, default=2)
+    burst.add_argument("--directory", default="pictures")
+    burst.add_argument("--workers", type=int, default=3, help="parallel downloads")
+
+    events = subparsers.add_parser("events", help="print the camera events")
+    events.add_argument("--duration", type=float, default=60)
+    events.add_argument("--full-dispatch", action="store_true",
+                        help="print unchanged events too")
+
+    liveview = subparsers.add_parser("liveview", help="record the liveview")
+    liveview.add_argument("--duration", type=float, default=10)
+    liveview.add_argument("--output", default="liveview.mjpeg")
+
+    fleet_take_picture = subparsers.add_parser(
+        "fleet-take-picture",
+        help="shoot with all the cameras at once (all the cameras found during the discovery timeout)"
+    )
+    fleet_take_picture.add_argument("--count", type=int, default=1)
+    fleet_take_picture.add_argument("--directory", default="pictures")
+
+    args = parser.parse_args()
+    if args.command == "timelapse" and args.interval <= 0:
+        parser.error("the interval must be positive")
+    return args
+
+
+def main():
+    args = parse_args()
+
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(levelname)-8s %(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.DEBUG if args.debug else logging.INFO)
+
+    loop = asyncio.get_event_loop()
+    try:
+        loop.run_until_complete(run(args))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loop.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
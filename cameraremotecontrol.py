@@ -1,23 +1,58 @@
 # -*- coding: utf-8 -*-
 
+import aiohttp
 import asyncio
 import gi
 gi.require_version("GUPnP", "1.0")
 from gi.repository import GUPnP
-import urllib.request
+import logging
 import urllib.parse
-from xml.etree.ElementTree import XML, XMLParser
-from xmlutils import StripNamespace
+from xml.etree.ElementTree import ParseError, XMLPullParser
+from xmlutils import strip_namespace
 
 from cameraremoteapi import CameraRemoteApi
 # from utils import debug_trace
 
+logger = logging.getLogger("cameraremote")
+
+SCALAR_WEB_API_SERVICE = "urn:schemas-sony-com:service:ScalarWebAPI:1"
+MANUFACTURER = "Sony"
+
+# device description download timeout (seconds) and read size
+DESCRIPTION_TIMEOUT = 5
+DESCRIPTION_CHUNK_SIZE = 4096
+
+# cached endpoints are probed until they answer or the device is discovered
+PROBE_TIMEOUT = 1
+PROBE_INTERVAL = 1
+PROBE_ATTEMPTS = 10
+PROBE_REQUEST = b'{"method": "getVersions", "params": [], "id": 1, "version": "1.0"}'
+
+
+def find_child_text(element, tag):
+    for child in element:
+        if strip_namespace(child.tag) == tag:
+            return child.text
+    return None
+
 
 class CameraRemoteControl(object):
+    """Discovers the cameras and calls callback(friendly_name, endpoint_url)
+    once for each of them
 
-    def __init__(self, friendly_name, callback):
+    With an endpoint cache, the endpoints of the cameras already seen are
+    tried directly while the discovery goes on, and discovered endpoints
+    are added to the cache.
+    """
+
+    def __init__(self, friendly_name, callback, endpoint_cache=None):
         self.__friendly_name = friendly_name
         self.__device_available_callback = callback
+        self.__endpoint_cache = endpoint_cache
+        # locations whose description is being or has been fetched
+        self.__locations = set()
+        # endpoints already notified
+        self.__endpoint_urls = set()
 
         ctx = GUPnP.Context.new(None, None, 0)
         # caution : keep cp as an attribute !
@@ -25,30 +60,92 @@ class CameraRemoteControl(object):
         self.cp.set_active(True)
         self.cp.connect("device-proxy-available", self.__device_available)
 
+        if endpoint_cache is not None:
+            for udn, cached_friendly_name, endpoint_url in endpoint_cache.get_endpoints(friendly_name):
+                asyncio.ensure_future(self.__probe_endpoint(cached_friendly_name, endpoint_url))
+
+    async def __notify(self, friendly_name, endpoint_url):
+        if endpoint_url in self.__endpoint_urls:
+            return
+        self.__endpoint_urls.add(endpoint_url)
+        await self.__device_available_callback(friendly_name, endpoint_url)
+
+    async def __probe_endpoint(self, friendly_name, endpoint_url):
+        headers = {'content-type': 'application/json'}
+        with aiohttp.ClientSession() as session:
+            for _ in range(PROBE_ATTEMPTS):
+                if endpoint_url in self.__endpoint_urls:
+                    return
+                try:
+                    with aiohttp.Timeout(PROBE_TIMEOUT):
+                        async with session.post(endpoint_url, data=PROBE_REQUEST, headers=headers) as resp:
+                            if resp.status == 200:
+                                logger.debug("cached endpoint %s answered" % (endpoint_url,))
+                                break
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    pass
+                await asyncio.sleep(PROBE_INTERVAL)
+            else:
+                logger.debug("cached endpoint %s did not answer" % (endpoint_url,))
+                return
+        await self.__notify(friendly_name, endpoint_url)
+
     def __device_available(self, cp, proxy):
+        # runs in the GUPnP signal callback: only filter here, the device
+        # description is fetched by a task
         proxy_friendly_name = proxy.get_friendly_name()
-        # print("Found " + proxy_friendly_name)
-        if proxy_friendly_name.startswith(self.__friendly_name):
-            service = proxy.get_service("urn:schemas-sony-com:service:ScalarWebAPI:1")
-            if service is not None:
-
-                # browse the xml location file and search for the camera service
-                # and set the action list uri
-                location = proxy.get_location()
-                xd = urllib.request.urlopen(location)
-                s = xd.read()
-
-                target = StripNamespace()
-                parser = XMLParser(target=target)
-                root = XML(s, parser=parser)
-
-                sl = root.findall("device/X_ScalarWebAPI_DeviceInfo/X_ScalarWebAPI_ServiceList/X_ScalarWebAPI_Service")
-                for s in sl:
-                    service_type = s.find("X_ScalarWebAPI_ServiceType").text
-                    if service_type == CameraRemoteApi.SERVICE_NAME:
-                        camera_action_list = s.find("X_ScalarWebAPI_ActionList_URL").text
-                        if not camera_action_list.endswith('/'):
-                            camera_action_list += '/'
-                        endpoint_url = urllib.parse.urljoin(camera_action_list, CameraRemoteApi.SERVICE_NAME)
-                        asyncio.ensure_future(self.__device_available_callback(proxy_friendly_name, endpoint_url))
-                        break
+        if not proxy_friendly_name.startswith(self.__friendly_name):
+            return
+        manufacturer = proxy.get_manufacturer()
+        if manufacturer is not None and not manufacturer.startswith(MANUFACTURER):
+            return
+        if proxy.get_service(SCALAR_WEB_API_SERVICE) is None:
+            return
+        location = proxy.get_location()
+        if location in self.__locations:
+            return
+        self.__locations.add(location)
+        asyncio.ensure_future(self.__fetch_endpoint_url(proxy.get_udn(), proxy_friendly_name, location))
+
+    async def __fetch_endpoint_url(self, udn, friendly_name, location):
+        try:
+            with aiohttp.Timeout(DESCRIPTION_TIMEOUT):
+                with aiohttp.ClientSession() as session:
+                    async with session.get(location) as resp:
+                        if resp.status != 200:
+                            logger.error("cannot get %s description: http status %d" %
+                                         (location, resp.status))
+                            # fetched again when the device is seen again
+                            self.__locations.discard(location)
+                            return
+                        camera_action_list = await self.__find_camera_action_list(resp)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ParseError) as e:
+            logger.error("cannot get %s description: %s" % (location, str(e)))
+            self.__locations.discard(location)
+            return
+        if camera_action_list is None:
+            logger.error("no %s service in %s" % (CameraRemoteApi.SERVICE_NAME, location))
+            return
+        if not camera_action_list.endswith('/'):
+            camera_action_list += '/'
+        endpoint_url = urllib.parse.urljoin(camera_action_list, CameraRemoteApi.SERVICE_NAME)
+        if self.__endpoint_cache is not None:
+            self.__endpoint_cache.update(udn, friendly_name, endpoint_url)
+        await self.__notify(friendly_name, endpoint_url)
+
+    async def __find_camera_action_list(self, resp):
+        """Parses the device description while it is downloaded and stops as
+        soon as the action list url of the camera service is found"""
+        parser = XMLPullParser(events=("end",))
+        while True:
+            chunk = await resp.content.read(DESCRIPTION_CHUNK_SIZE)
+            if not chunk:
+                parser.close()
+                return None
+            parser.feed(chunk)
+            for _, element in parser.read_events():
+                if strip_namespace(element.tag) != "X_ScalarWebAPI_Service":
+                    continue
+                service_type = find_child_text(element, "X_ScalarWebAPI_ServiceType")
+                if service_type == CameraRemoteApi.SERVICE_NAME:
+                    return find_child_text(element, "X_ScalarWebAPI_ActionList_URL")
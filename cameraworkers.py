@@ -0,0 +1,353 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+from collections import Counter
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+
+from cameraremoteapi import CameraRemoteApi, CameraRemoteException
+from metrics import REGISTRY
+
+logger = logging.getLogger("cameraremote")
+
+# period of the metrics sent by the workers (seconds)
+METRICS_INTERVAL = 1.0
+
+# messages exchanged over the pipes are tuples whose first item is their kind
+#   coordinator -> worker:
+#     ("call", call_id, endpoint_url or None for all, method, args, kwargs)
+#     ("stop",)
+#   worker -> coordinator:
+#     ("ready", worker_index, endpoint_urls ready, {endpoint_url: error message})
+#     ("result", call_id, endpoint_url, result, error message or None)
+#     ("event", endpoint_url, event_name, data)
+#     ("metrics", worker_index, metrics)
+
+
+class PipeWriter(object):
+    """Sends messages over a pipe connection from a thread, so that a full
+    pipe never blocks the event loop"""
+
+    def __init__(self, conn):
+        self.__conn = conn
+        self.__messages = queue.Queue()
+        self.__broken = False
+        self.__thread = threading.Thread(target=self.__write, daemon=True)
+        self.__thread.start()
+
+    def __write(self):
+        while True:
+            message = self.__messages.get()
+            if message is None:
+                return
+            try:
+                self.__conn.send(message)
+            except (BrokenPipeError, OSError) as e:
+                logger.error("pipe write failed: %s" % (str(e),))
+                self.__broken = True
+                return
+            except Exception as e:
+                # not picklable
+                logger.error("cannot send %s message: %s" % (message[0], str(e)))
+
+    def send(self, message):
+        if not self.__broken:
+            self.__messages.put(message)
+
+    def close(self):
+        """Waits for the queued messages to be sent and ends the thread"""
+        self.__messages.put(None)
+        self.__thread.join()
+
+
+class CameraWorker(object):
+    """Drives a shard of the cameras in a worker process"""
+
+    def __init__(self, worker_index, conn, endpoint_urls, device_names, watched_events, loop):
+        self.__worker_index = worker_index
+        self.__conn = conn
+        self.__writer = PipeWriter(conn)
+        self.__endpoint_urls = endpoint_urls
+        self.__device_names = device_names
+        self.__watched_events = watched_events
+        self.__loop = loop
+        self.__cameras = {}
+        self.__events_count = Counter()
+        self.__stopped = asyncio.Future(loop=loop)
+
+    def __event_callback(self, endpoint_url, event_name):
+        def callback(data):
+            self.__events_count[event_name] += 1
+            self.__writer.send(("event", endpoint_url, event_name, data))
+        return callback
+
+    async def __add_camera(self, endpoint_url):
+        camera_api = CameraRemoteApi(endpoint_url, self.__loop)
+        try:
+            events_watcher = await camera_api.initial_checks(self.__device_names.get(endpoint_url))
+            if camera_api.is_method_available("startRecMode"):
+                await camera_api.startRecMode()
+        except:
+            camera_api.close()
+            raise
+        watched_events = self.__watched_events
+        if watched_events is None:
+            watched_events = events_watcher.get_event_names()
+        events_watcher.register_events({
+            event_name: self.__event_callback(endpoint_url, event_name)
+            for event_name in watched_events
+        })
+        events_watcher.start_event_watcher()
+        self.__cameras[endpoint_url] = camera_api
+
+    async def __call_camera(self, call_id, endpoint_url, method, args, kwargs):
+        try:
+            result = await getattr(self.__cameras[endpoint_url], method)(*args, **kwargs)
+        except Exception as e:
+            self.__writer.send(("result", call_id, endpoint_url, None, str(e)))
+        else:
+            self.__writer.send(("result", call_id, endpoint_url, result, None))
+
+    async def __call(self, call_id, endpoint_url, method, args, kwargs):
+        endpoint_urls = [endpoint_url] if endpoint_url is not None else list(self.__cameras)
+        # the cameras are called at once, each result is sent as it comes
+        await asyncio.gather(
+            *[self.__call_camera(call_id, endpoint_url, method, args, kwargs)
+              for endpoint_url in endpoint_urls],
+            return_exceptions=True
+        )
+
+    def __on_command(self):
+        try:
+            while self.__conn.poll():
+                message = self.__conn.recv()
+                if message[0] == "call":
+                    asyncio.ensure_future(self.__call(*message[1:]), loop=self.__loop)
+                elif message[0] == "stop":
+                    self.__stopped.set_result(None)
+                    return
+        except EOFError:
+            # the coordinator is gone
+            self.__stopped.set_result(None)
+
+    async def __send_metrics(self):
+        while True:
+            await asyncio.sleep(METRICS_INTERVAL)
+            metrics = {
+                "pid": os.getpid(),
+                "events": dict(self.__events_count),
+                "cameras": {
+                    endpoint_url: {
+                        "in_flight": camera_api.get_in_flight_count(),
+                        "http_pool": camera_api.get_http_pool().get_stats(),
+                    }
+                    for endpoint_url, camera_api in self.__cameras.items()
+                },
+                "registry": REGISTRY.snapshot(),
+            }
+            self.__writer.send(("metrics", self.__worker_index, metrics))
+
+    async def run(self):
+        # a camera failing does not stop the others
+        results = await asyncio.gather(
+            *[self.__add_camera(endpoint_url) for endpoint_url in self.__endpoint_urls],
+            return_exceptions=True
+        )
+        failures = {
+            endpoint_url: str(result)
+            for endpoint_url, result in zip(self.__endpoint_urls, results)
+            if isinstance(result, Exception)
+        }
+        self.__writer.send(("ready", self.__worker_index, list(self.__cameras), failures))
+        self.__loop.add_reader(self.__conn.fileno(), self.__on_command)
+        metrics_task = asyncio.ensure_future(self.__send_metrics(), loop=self.__loop)
+        try:
+            await self.__stopped
+        finally:
+            self.__loop.remove_reader(self.__conn.fileno())
+            metrics_task.cancel()
+            for camera_api in self.__cameras.values():
+                camera_api.close()
+            await self.__loop.run_in_executor(None, self.__writer.close)
+
+
+def worker_main(worker_index, conn, endpoint_urls, device_names, watched_events):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_until_complete(
+            CameraWorker(worker_index, conn, endpoint_urls, device_names, watched_events, loop).run()
+        )
+    finally:
+        loop.close()
+        conn.close()
+
+
+class CameraWorkerPool(object):
+    """Shards cameras across worker processes
+
+    Each worker runs its own event loop with a CameraRemoteApi and a
+    CameraRemoteEventWatcher per camera. The coordinator talks to the
+    workers over pipes read from its event loop.
+    event_callback(endpoint_url, event_name, data) receives the events of
+    all the cameras; watched_events restricts them (all by default).
+    device_names gives the device name (model) of the cameras by endpoint
+    url, when it is known.
+    """
+
+    def __init__(self, endpoint_urls, processes=None, watched_events=None, event_callback=None,
+                 device_names=None):
+        if processes is None:
+            processes = os.cpu_count() or 1
+        processes = max(min(processes, len(endpoint_urls)), 1)
+        # round robin sharding
+        self.__shards = [endpoint_urls[index::processes] for index in range(processes)]
+        self.__watched_events = watched_events
+        self.__event_callback = event_callback
+        self.__device_names = device_names if device_names is not None else {}
+
+        self.__processes = []
+        self.__conns = []
+        self.__writers = []
+        self.__owners = {}
+        self.__metrics = {}
+        self.__ready = []
+        self.__stopped_workers = set()
+        # cameras which could not be added, endpoint url -> error message
+        self.__failures = {}
+        self.__call_id = 1
+        # call_id -> (future, results, endpoint urls expected)
+        self.__calls = {}
+
+    async def start(self):
+        """Starts the workers and waits for their cameras to be ready. The
+        cameras which fail are left out (see get_failures), the workers are
+        stopped if one of them fails"""
+        loop = asyncio.get_event_loop()
+        context = multiprocessing.get_context("spawn")
+        for worker_index, shard in enumerate(self.__shards):
+            parent_conn, child_conn = context.Pipe()
+            process = context.Process(
+                target=worker_main,
+                args=(worker_index, child_conn, shard,
+                      {url: self.__device_names.get(url) for url in shard}, self.__watched_events),
+                daemon=True
+            )
+            process.start()
+            child_conn.close()
+            self.__processes.append(process)
+            self.__conns.append(parent_conn)
+            self.__writers.append(PipeWriter(parent_conn))
+            ready = asyncio.Future()
+            self.__ready.append(ready)
+            loop.add_reader(parent_conn.fileno(), self.__on_message, worker_index)
+            for endpoint_url in shard:
+                self.__owners[endpoint_url] = worker_index
+        try:
+            await asyncio.gather(*self.__ready)
+        except:
+            await self.stop()
+            raise
+
+    def __on_message(self, worker_index):
+        conn = self.__conns[worker_index]
+        try:
+            while conn.poll():
+                self.__handle_message(worker_index, conn.recv())
+        except EOFError:
+            logger.error("camera worker %d stopped" % (worker_index,))
+            asyncio.get_event_loop().remove_reader(conn.fileno())
+            self.__stopped_workers.add(worker_index)
+            if not self.__ready[worker_index].done():
+                self.__ready[worker_index].set_exception(
+                    CameraRemoteException("camera worker %d failed to start" % (worker_index,))
+                )
+            # the results of its cameras will not come
+            for call_id in list(self.__calls):
+                self.__fail_stopped_cameras(call_id)
+
+    def __fail_stopped_cameras(self, call_id):
+        _, results, endpoint_urls = self.__calls[call_id]
+        for endpoint_url in endpoint_urls:
+            worker_index = self.__owners[endpoint_url]
+            if endpoint_url not in results and worker_index in self.__stopped_workers:
+                results[endpoint_url] = CameraRemoteException(
+                    "camera worker %d stopped" % (worker_index,)
+                )
+        self.__complete_call(call_id)
+
+    def __complete_call(self, call_id):
+        future, results, endpoint_urls = self.__calls[call_id]
+        if len(results) == len(endpoint_urls):
+            del self.__calls[call_id]
+            if not future.done():
+                future.set_result(results)
+
+    def __handle_message(self, worker_index, message):
+        kind = message[0]
+        if kind == "event":
+            if self.__event_callback is not None:
+                self.__event_callback(*message[1:])
+        elif kind == "result":
+            call_id, endpoint_url, result, error = message[1:]
+            _, results, _ = self.__calls[call_id]
+            results[endpoint_url] = CameraRemoteException(error) if error is not None else result
+            self.__complete_call(call_id)
+        elif kind == "metrics":
+            self.__metrics[worker_index] = message[2]
+        elif kind == "ready":
+            endpoint_urls, failures = message[2:]
+            for endpoint_url, error in failures.items():
+                logger.error("camera %s not added: %s" % (endpoint_url, error))
+                del self.__owners[endpoint_url]
+            self.__failures.update(failures)
+            self.__ready[worker_index].set_result(endpoint_urls)
+
+    async def call(self, method, *args, endpoint_url=None, **kwargs):
+        """Calls a method on one camera or on all of them. Returns a
+        dictionary of the results indexed by endpoint url, failed calls
+        give a CameraRemoteException"""
+        call_id = self.__call_id
+        self.__call_id += 1
+        future = asyncio.Future()
+        if endpoint_url is None and not self.__owners:
+            return {}
+        if endpoint_url is not None and endpoint_url not in self.__owners:
+            raise CameraRemoteException("camera %s not available" % (endpoint_url,))
+        if endpoint_url is not None:
+            self.__calls[call_id] = (future, {}, [endpoint_url])
+            worker_index = self.__owners[endpoint_url]
+            if worker_index not in self.__stopped_workers:
+                self.__writers[worker_index].send(
+                    ("call", call_id, endpoint_url, method, args, kwargs)
+                )
+        else:
+            self.__calls[call_id] = (future, {}, list(self.__owners))
+            for worker_index, writer in enumerate(self.__writers):
+                if worker_index not in self.__stopped_workers:
+                    writer.send(("call", call_id, None, method, args, kwargs))
+        self.__fail_stopped_cameras(call_id)
+        return await future
+
+    def get_failures(self):
+        """Returns the error messages of the cameras which could not be
+        added, indexed by endpoint url"""
+        return dict(self.__failures)
+
+    def get_metrics(self):
+        """Returns the last metrics sent by each worker"""
+        return dict(self.__metrics)
+
+    async def stop(self):
+        loop = asyncio.get_event_loop()
+        for conn, writer in zip(self.__conns, self.__writers):
+            loop.remove_reader(conn.fileno())
+            writer.send(("stop",))
+            await loop.run_in_executor(None, writer.close)
+        for process in self.__processes:
+            await loop.run_in_executor(None, process.join)
+        for conn in self.__conns:
+            conn.close()
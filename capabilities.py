@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+
+
+class CapabilityIndex(object):
+    """Set of the currently available api methods
+
+    Each change of the set increments its version and is notified to the
+    subscribers with the added and removed method names. Updates which do
+    not change anything are not notified.
+    """
+
+    def __init__(self, apis=()):
+        self.__apis = frozenset(apis)
+        self.__version = 0
+        self.__subscribers = []
+
+    def __contains__(self, name):
+        return name in self.__apis
+
+    def __iter__(self):
+        return iter(self.__apis)
+
+    def __len__(self):
+        return len(self.__apis)
+
+    def get_version(self):
+        return self.__version
+
+    def get_apis(self):
+        return self.__apis
+
+    def subscribe(self, callback):
+        """callback(capability_index, added, removed) is called on each change"""
+        self.__subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        self.__subscribers.remove(callback)
+
+    def update(self, apis):
+        """Replaces the available methods, returns the (added, removed) sets"""
+        apis = frozenset(apis)
+        added = apis - self.__apis
+        removed = self.__apis - apis
+        if added or removed:
+            self.__apis = apis
+            self.__version += 1
+            for callback in list(self.__subscribers):
+                callback(self, added, removed)
+        return added, removed
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+from metrics import REGISTRY
+import os
+import urllib.parse
+
+# chunks start small so that the first progress report comes early and grow
+# as long as the connection fills them
+MIN_CHUNK_SIZE = 64 * 1024
+MAX_CHUNK_SIZE = 1024 * 1024
+
+# minimum delay between two progress reports (seconds)
+PROGRESS_INTERVAL = 0.1
+
+
+def url_file_name(url):
+    """Returns the file name part of an url"""
+    return os.path.basename(urllib.parse.urlparse(url).path)
+
+
+async def download_to_file(response, path, progress_callback=None, offset=0):
+    """Writes the body of an aiohttp response to path
+
+    File writes are done in the default executor and overlap with the
+    network reads, at most two chunks are held in memory.
+    progress_callback(downloaded, content_length) is throttled to one call
+    per PROGRESS_INTERVAL plus a final one; content_length is None when the
+    server does not send it. With an offset, the response is the rest of a
+    file whose first offset bytes are already in path (range request): the
+    body is appended and offset counted in the progress. Returns the number
+    of bytes of the file.
+    """
+    loop = asyncio.get_event_loop()
+    content_length = response.headers.get("CONTENT-LENGTH")
+    if content_length is not None:
+        content_length = int(content_length) + offset
+
+    downloaded = offset
+    chunk_size = MIN_CHUNK_SIZE
+    start = last_progress = loop.time()
+    write_future = None
+    with open(path, "ab" if offset else "wb") as fd:
+        try:
+            while True:
+                chunk = await response.content.read(chunk_size)
+                if write_future is not None:
+                    await write_future
+                    write_future = None
+                if not chunk:
+                    break
+                write_future = loop.run_in_executor(None, fd.write, chunk)
+                downloaded += len(chunk)
+                if len(chunk) == chunk_size and chunk_size < MAX_CHUNK_SIZE:
+                    chunk_size *= 2
+
+                if progress_callback is not None:
+                    now = loop.time()
+                    if now - last_progress >= PROGRESS_INTERVAL:
+                        last_progress = now
+                        progress_callback(downloaded, content_length)
+        finally:
+            if write_future is not None:
+                await asyncio.wait([write_future])
+    elapsed = loop.time() - start
+    REGISTRY.inc("download_bytes_total", downloaded - offset)
+    REGISTRY.observe("download_seconds", elapsed)
+    if elapsed > 0:
+        REGISTRY.set("download_megabytes_per_second", (downloaded - offset) / elapsed / 1e6)
+    if progress_callback is not None:
+        progress_callback(downloaded, content_length)
+    return downloaded
+
+
+async def save_picture(http_pool, url, directory, progress_callback=None):
+    """Downloads a jpeg picture into directory using the download
+    connections of http_pool. Returns the path of the file or None if the
+    url is not a jpeg picture"""
+    async with http_pool.get("download", url) as resp:
+        if resp.status != 200 or resp.headers.get("CONTENT-TYPE") != "image/jpeg":
+            return None
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, url_file_name(url))
+        await download_to_file(resp, path, progress_callback)
+    return path
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+
+import aiohttp
+import asyncio
+import logging
+import os
+
+from download import download_to_file, url_file_name
+from httppool import DEFAULT_LIMITS
+
+logger = logging.getLogger("cameraremote")
+
+# preview downloads go first, newest first; archival ones in order
+PRIORITY_PREVIEW = 0
+PRIORITY_ARCHIVE = 1
+
+DEFAULT_PARALLELISM = DEFAULT_LIMITS["download"]
+
+# attempts of a download interrupted by a network error, each one resuming
+# the partial file, and delay between them (seconds)
+MAX_ATTEMPTS = 5
+RETRY_DELAY = 1.0
+
+# maximum duration of one attempt (seconds)
+ATTEMPT_TIMEOUT = 60
+
+PARTIAL_SUFFIX = ".part"
+
+
+class DownloadJob(object):
+
+    def __init__(self, url, priority, progress_callback, fresh=False):
+        self.url = url
+        self.priority = priority
+        self.progress_callback = progress_callback
+        # a partial file left by an earlier download of the url may belong
+        # to another picture
+        self.fresh = fresh
+        self.future = asyncio.Future()
+        self.task = None
+
+
+class DownloadManager(object):
+    """Downloads the pictures of a camera into a directory
+
+    parallelism downloads run at once, picked by priority: the newest
+    PRIORITY_PREVIEW one first, then the PRIORITY_ARCHIVE ones in request
+    order. An url requested while it is still queued shares the queued
+    download. Some cameras give the same url to every shot: an url
+    requested while it is downloading may be a new picture, it is
+    downloaded again once the running download is over and replaces its
+    file. Interrupted downloads are resumed with range requests from their
+    partial file. The "download" limit of
+    the http pool should be at least parallelism, extra downloads wait for
+    a connection.
+    """
+
+    def __init__(self, http_pool, directory, parallelism=DEFAULT_PARALLELISM):
+        if parallelism > http_pool.get_limit("download"):
+            logger.warning("%d parallel downloads over %d download connections" %
+                           (parallelism, http_pool.get_limit("download")))
+        self.__http_pool = http_pool
+        self.__directory = directory
+        self.__parallelism = parallelism
+        self.__queue = asyncio.PriorityQueue()
+        self.__sequence = 0
+        # queued and running jobs, url -> DownloadJob
+        self.__jobs = {}
+        # jobs waiting for the running job of their url, url -> DownloadJob
+        self.__next_jobs = {}
+        self.__workers = []
+        self.__stats = {"downloaded": 0, "shared": 0, "resumed": 0, "failed": 0, "cancelled": 0}
+
+    def start(self):
+        self.__workers = [asyncio.ensure_future(self.__worker()) for _ in range(self.__parallelism)]
+
+    def get_stats(self):
+        stats = dict(self.__stats)
+        stats["pending"] = len(self.__jobs) + len(self.__next_jobs)
+        return stats
+
+    def __push(self, job):
+        self.__sequence += 1
+        order = -self.__sequence if job.priority == PRIORITY_PREVIEW else self.__sequence
+        self.__queue.put_nowait((job.priority, order, self.__sequence, job))
+
+    def download(self, url, priority=PRIORITY_ARCHIVE, progress_callback=None):
+        """Queues the download of url, returns a future of the path of the
+        file (None if the url is not a jpeg picture).
+        progress_callback(downloaded, content_length) as in download_to_file"""
+        job = self.__jobs.get(url)
+        if job is not None and job.task is None:
+            self.__share(job, progress_callback)
+            if priority < job.priority:
+                # queued again at the higher priority, the stale entry is
+                # skipped
+                job.priority = priority
+                self.__push(job)
+            return job.future
+        if job is not None:
+            # running: pushed once it is over
+            next_job = self.__next_jobs.get(url)
+            if next_job is not None:
+                self.__share(next_job, progress_callback)
+                next_job.priority = min(priority, next_job.priority)
+            else:
+                next_job = DownloadJob(url, priority, progress_callback, fresh=True)
+                self.__next_jobs[url] = next_job
+            return next_job.future
+        job = DownloadJob(url, priority, progress_callback)
+        self.__jobs[url] = job
+        self.__push(job)
+        return job.future
+
+    def __share(self, job, progress_callback):
+        self.__stats["shared"] += 1
+        if progress_callback is not None:
+            job.progress_callback = progress_callback
+
+    def cancel(self, url):
+        for jobs in (self.__jobs, self.__next_jobs):
+            job = jobs.pop(url, None)
+            if job is not None:
+                self.__cancel_job(job)
+
+    def __cancel_job(self, job):
+        self.__stats["cancelled"] += 1
+        if job.task is not None:
+            job.task.cancel()
+        job.future.cancel()
+
+    def __progress(self, job):
+        def progress_callback(downloaded, content_length):
+            if job.progress_callback is not None:
+                job.progress_callback(downloaded, content_length)
+        return progress_callback
+
+    async def __download(self, job):
+        path = os.path.join(self.__directory, url_file_name(job.url))
+        partial_path = path + PARTIAL_SUFFIX
+        os.makedirs(self.__directory, exist_ok=True)
+        if job.fresh and os.path.exists(partial_path):
+            os.remove(partial_path)
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            offset = os.path.getsize(partial_path) if os.path.exists(partial_path) else 0
+            headers = {"RANGE": "bytes=%d-" % (offset,)} if offset else None
+            try:
+                with aiohttp.Timeout(ATTEMPT_TIMEOUT):
+                    async with self.__http_pool.get("download", job.url, headers=headers) as resp:
+                        if resp.status == 200:
+                            # the whole file, the range is not supported
+                            offset = 0
+                        elif resp.status == 206:
+                            self.__stats["resumed"] += 1
+                        elif resp.status == 416:
+                            # the partial file does not match
+                            os.remove(partial_path)
+                            continue
+                        else:
+                            return None
+                        if resp.headers.get("CONTENT-TYPE") != "image/jpeg":
+                            return None
+                        await download_to_file(resp, partial_path, self.__progress(job), offset)
+                os.replace(partial_path, path)
+                return path
+            except (aiohttp.ClientError, asyncio.TimeoutError, ConnectionError) as e:
+                if attempt == MAX_ATTEMPTS:
+                    raise
+                logger.warning("download of %s interrupted (%s), resuming" % (job.url, str(e)))
+                await asyncio.sleep(RETRY_DELAY)
+        return None
+
+    async def __worker(self):
+        while True:
+            priority, _, _, job = await self.__queue.get()
+            if job.future.done() or job.task is not None or priority != job.priority:
+                # cancelled, or entry left behind by a priority change
+                continue
+            job.task = asyncio.ensure_future(self.__download(job))
+            await asyncio.wait([job.task])
+            if self.__jobs.get(job.url) is job:
+                del self.__jobs[job.url]
+                next_job = self.__next_jobs.pop(job.url, None)
+                if next_job is not None:
+                    self.__jobs[job.url] = next_job
+                    self.__push(next_job)
+            if job.future.done():
+                continue
+            if job.task.cancelled():
+                job.future.cancel()
+            elif job.task.exception() is not None:
+                self.__stats["failed"] += 1
+                logger.error("download of %s failed: %s" % (job.url, str(job.task.exception())))
+                job.future.set_exception(job.task.exception())
+            else:
+                self.__stats["downloaded"] += 1
+                job.future.set_result(job.task.result())
+
+    def close(self):
+        """Cancels the workers and the downloads, partial files are kept
+        for a later resume"""
+        for worker in self.__workers:
+            worker.cancel()
+        self.__workers = []
+        for jobs in (self.__jobs, self.__next_jobs):
+            for job in jobs.values():
+                self.__cancel_job(job)
+            jobs.clear()
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+
+import time
+
+from utils import cache_path, read_json_file, write_json_file
+
+
+class EndpointCache(object):
+    """Endpoint urls of the cameras already seen, kept on disk
+
+    Entries are indexed by device UDN and hold the friendly name, the
+    endpoint url and the time the device was last seen.
+    """
+
+    def __init__(self, path=None):
+        self.__path = path if path is not None else cache_path("endpoints.json")
+        self.__entries = read_json_file(self.__path, {})
+
+    def get_endpoints(self, friendly_name):
+        """Returns the (udn, friendly name, endpoint url) of the devices whose
+        friendly name starts with friendly_name, most recently seen first"""
+        entries = sorted(self.__entries.items(), key=lambda item: item[1]["last_seen"], reverse=True)
+        return [
+            (udn, entry["friendly_name"], entry["endpoint_url"])
+            for udn, entry in entries
+            if entry["friendly_name"].startswith(friendly_name)
+        ]
+
+    def update(self, udn, friendly_name, endpoint_url):
+        self.__entries[udn] = {
+            "friendly_name": friendly_name,
+            "endpoint_url": endpoint_url,
+            "last_seen": time.time(),
+        }
+        write_json_file(self.__path, self.__entries)
+
+    def remove(self, udn):
+        if self.__entries.pop(udn, None) is not None:
+            write_json_file(self.__path, self.__entries)
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+
+import aiohttp
+import asyncio
+import logging
+import weakref
+
+logger = logging.getLogger("cameraremote")
+
+# maximum number of simultaneous connections to the camera for each kind of
+# traffic. each purpose has its own connector so that a long polling
+# getEvent or a liveview stream never holds a connection needed elsewhere
+DEFAULT_LIMITS = {
+    "rpc": 4,
+    "event": 1,
+    "liveview": 1,
+    "download": 2,
+}
+
+# maximum wait for a free connection of a purpose (seconds)
+DEFAULT_ACQUIRE_TIMEOUT = 10
+
+
+class PoolPurpose(object):
+    """Session, connection slots and counters of one kind of traffic"""
+
+    def __init__(self, name, limit, loop):
+        self.name = name
+        self.limit = limit
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=limit, loop=loop), loop=loop
+        )
+        self.slots = asyncio.Semaphore(limit)
+        # transports of the connections already used, to tell the new
+        # connections from the reused ones
+        self.transports = weakref.WeakSet()
+        self.requests = 0
+        self.connections = 0
+        self.reused = 0
+        self.waits = 0
+        self.acquire_timeouts = 0
+
+    def count_connection(self, response):
+        connection = response.connection
+        transport = connection.transport if connection is not None else None
+        if transport is None:
+            # already given back to the connector
+            return
+        if transport in self.transports:
+            self.reused += 1
+        else:
+            self.transports.add(transport)
+            self.connections += 1
+
+
+class PooledRequest(object):
+    """Async context manager of a request: waits for a free connection of
+    its purpose, at most acquire_timeout seconds, and gives it back when
+    the response is released"""
+
+    def __init__(self, purpose, acquire_timeout, method, url, kwargs):
+        self.__purpose = purpose
+        self.__acquire_timeout = acquire_timeout
+        self.__method = method
+        self.__url = url
+        # called once the connection is acquired, right before the request
+        # is written
+        self.__sent_callback = kwargs.pop("sent_callback", None)
+        self.__kwargs = kwargs
+        self.__request = None
+
+    async def __aenter__(self):
+        purpose = self.__purpose
+        if not purpose.slots.locked():
+            # a connection is free, no wait
+            await purpose.slots.acquire()
+        else:
+            purpose.waits += 1
+            try:
+                await asyncio.wait_for(purpose.slots.acquire(), self.__acquire_timeout)
+            except asyncio.TimeoutError:
+                purpose.acquire_timeouts += 1
+                logger.error("no free %s connection after %s s, %d in use" %
+                             (purpose.name, self.__acquire_timeout, purpose.limit))
+                raise
+        try:
+            if self.__sent_callback is not None:
+                self.__sent_callback()
+            self.__request = purpose.session.request(self.__method, self.__url, **self.__kwargs)
+            response = await self.__request.__aenter__()
+        except BaseException:
+            purpose.slots.release()
+            raise
+        purpose.count_connection(response)
+        return response
+
+    async def __aexit__(self, exc_type, exc, tb):
+        try:
+            return await self.__request.__aexit__(exc_type, exc, tb)
+        finally:
+            self.__purpose.slots.release()
+
+
+class HttpPool(object):
+    """Keep-alive http connections to one camera, split by purpose"""
+
+    def __init__(self, loop, limits=None, acquire_timeout=DEFAULT_ACQUIRE_TIMEOUT):
+        all_limits = dict(DEFAULT_LIMITS)
+        if limits is not None:
+            all_limits.update(limits)
+        self.__acquire_timeout = acquire_timeout
+        self.__purposes = {
+            purpose: PoolPurpose(purpose, limit, loop) for purpose, limit in all_limits.items()
+        }
+
+    def get_limit(self, purpose):
+        return self.__purposes[purpose].limit
+
+    def request(self, purpose, method, url, **kwargs):
+        """Returns an async context manager of the response, the arguments
+        being those of aiohttp.ClientSession.request, purpose one of the
+        keys of the limits. Raises asyncio.TimeoutError when no connection
+        of the purpose is free within the acquire timeout. sent_callback()
+        is called once the connection is acquired"""
+        try:
+            pool_purpose = self.__purposes[purpose]
+        except KeyError as e:
+            raise ValueError("\"%s\" : unknown purpose" % (purpose,)) from e
+        pool_purpose.requests += 1
+        return PooledRequest(pool_purpose, self.__acquire_timeout, method, url, kwargs)
+
+    def get(self, purpose, url, **kwargs):
+        return self.request(purpose, "GET", url, **kwargs)
+
+    def post(self, purpose, url, **kwargs):
+        return self.request(purpose, "POST", url, **kwargs)
+
+    def get_stats(self):
+        """Returns, for each purpose, the connection limit, the number of
+        requests, of connections opened, of requests sent on an already
+        opened connection, of requests which waited for a free connection
+        and of those which gave up"""
+        stats = {}
+        for name, purpose in self.__purposes.items():
+            stats[name] = {
+                "limit": purpose.limit,
+                "requests": purpose.requests,
+                "connections": purpose.connections,
+                "reused": purpose.reused,
+                "waits": purpose.waits,
+                "acquire_timeouts": purpose.acquire_timeouts,
+            }
+        return stats
+
+    def close(self):
+        for purpose in self.__purposes.values():
+            purpose.session.close()
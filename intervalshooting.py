@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+import aiohttp
+import asyncio
+import logging
+import math
+
+from cameraremoteapi import CameraRemoteException
+from download import save_picture
+from metrics import REGISTRY
+
+logger = logging.getLogger("cameraremote")
+
+
+class IntervalShootingStats(object):
+    """Trigger jitter (delay between the scheduled and actual trigger
+    times, in seconds) of the shots and counts of missed slots and
+    failed shots"""
+
+    def __init__(self):
+        self.jitters = []
+        self.missed_slots = 0
+        self.failed_shots = 0
+        self.downloads = 0
+
+    def get_summary(self):
+        jitters = sorted(self.jitters)
+        summary = {
+            "shots": len(jitters),
+            "missed_slots": self.missed_slots,
+            "failed_shots": self.failed_shots,
+            "downloads": self.downloads,
+        }
+        if jitters:
+            summary.update({
+                "mean_jitter": sum(jitters) / len(jitters),
+                "p95_jitter": jitters[min(int(len(jitters) * 0.95), len(jitters) - 1)],
+                "max_jitter": jitters[-1],
+            })
+        return summary
+
+
+class IntervalShooter(object):
+    """Host side time-lapse: calls actTakePicture every interval seconds
+
+    Shot n is scheduled at start + n * interval on the monotonic clock of
+    the event loop, so late triggers do not delay the next ones. When a
+    shot takes longer than the interval, the slots already over are
+    skipped and counted as missed. Postviews are downloaded into directory
+    in the background while the next shots are taken (not downloaded when
+    directory is None).
+    """
+
+    def __init__(self, camera_api, interval, count=None, directory=None):
+        if interval <= 0:
+            raise ValueError("\"%s\" : wrong interval" % (interval,))
+        self.__camera_api = camera_api
+        self.__interval = interval
+        self.__count = count
+        self.__directory = directory
+        self.__stats = IntervalShootingStats()
+        self.__downloads = asyncio.Queue()
+
+    def get_stats(self):
+        return self.__stats
+
+    async def __download_postviews(self):
+        http_pool = self.__camera_api.get_http_pool()
+        while True:
+            url = await self.__downloads.get()
+            try:
+                path = await save_picture(http_pool, url, self.__directory)
+                if path is not None:
+                    self.__stats.downloads += 1
+                    logger.debug("%s downloaded" % (path,))
+            except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+                logger.error("postview %s download failed: %s" % (url, str(e)))
+            finally:
+                self.__downloads.task_done()
+
+    async def __shoot(self):
+        try:
+            result = await self.__camera_api.actTakePicture()
+        except (CameraRemoteException, aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+            # a network failure must not end the time-lapse
+            self.__stats.failed_shots += 1
+            logger.error("interval shot failed: %s" % (str(e),))
+            return
+        if result is not None and self.__directory is not None:
+            for url in result[0]:
+                self.__downloads.put_nowait(url)
+
+    async def run(self):
+        """Shoots count pictures (forever if count is None) and returns the
+        stats once the last postview is downloaded"""
+        loop = asyncio.get_event_loop()
+        download_task = asyncio.ensure_future(self.__download_postviews())
+        start = loop.time()
+        slot = 0
+        try:
+            while self.__count is None or slot < self.__count:
+                target = start + slot * self.__interval
+                delay = target - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                elif -delay >= self.__interval:
+                    # late by more than one interval: skip to the next slot
+                    # still to come
+                    next_slot = int(math.ceil((loop.time() - start) / self.__interval))
+                    if self.__count is not None:
+                        next_slot = min(next_slot, self.__count)
+                    missed = next_slot - slot
+                    self.__stats.missed_slots += missed
+                    REGISTRY.inc("interval_missed_slots_total", missed)
+                    logger.warning("%d interval slots missed" % (missed,))
+                    slot = next_slot
+                    continue
+                jitter = loop.time() - target
+                self.__stats.jitters.append(jitter)
+                REGISTRY.observe("interval_trigger_jitter_seconds", jitter)
+                await self.__shoot()
+                slot += 1
+            await self.__downloads.join()
+        finally:
+            download_task.cancel()
+        return self.__stats
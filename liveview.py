@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+from collections import namedtuple
+from struct import Struct
+
+from cameraremoteapi import CameraRemoteException
+from metrics import RateGauge, REGISTRY
+
+# common header (8 bytes) followed by the beginning of the payload header
+# (start code, 3 bytes payload data size and 1 byte padding size). the 120
+# remaining bytes of the 128 bytes payload header are reserved
+COMMON_HEADER_SIZE = 8
+PAYLOAD_HEADER_SIZE = 128
+HEADERS_SIZE = COMMON_HEADER_SIZE + PAYLOAD_HEADER_SIZE
+HEADERS = Struct(">BBHI4sI")
+
+START_BYTE = 0xff
+PAYLOAD_START_CODE = b"\x24\x35\x68\x79"
+
+PAYLOAD_TYPE_JPEG = 0x01
+PAYLOAD_TYPE_FRAME_INFO = 0x02
+
+LiveviewFrame = namedtuple(
+    "LiveviewFrame",
+    ["payload_type", "sequence_number", "timestamp", "data"]
+)
+
+
+class LiveviewStreamReader(object):
+    """Async iterator over the frames of a liveview stream
+
+    stream is any object with an asyncio.StreamReader like readexactly
+    coroutine (for instance the content of an aiohttp response). Each
+    iteration yields a LiveviewFrame whose data is the payload (a jpeg
+    image for PAYLOAD_TYPE_JPEG frames). Frames of other payload types are
+    skipped unless all_payloads is True.
+    """
+
+    def __init__(self, stream, all_payloads=False):
+        self.__stream = stream
+        self.__all_payloads = all_payloads
+        self.__fps = RateGauge(REGISTRY, "liveview_fps")
+        self.__byte_rate = RateGauge(REGISTRY, "liveview_bytes_per_second")
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        readexactly = self.__stream.readexactly
+        while True:
+            try:
+                headers = await readexactly(HEADERS_SIZE)
+            except EOFError:
+                # asyncio.IncompleteReadError is a subclass of EOFError
+                raise StopAsyncIteration
+            start_byte, payload_type, sequence_number, timestamp, start_code, sizes = \
+                HEADERS.unpack_from(headers)
+            if start_byte != START_BYTE or start_code != PAYLOAD_START_CODE:
+                raise CameraRemoteException("desynchronized from liveview stream")
+            payload_size = sizes >> 8
+            padding_size = sizes & 0xff
+
+            if payload_type == PAYLOAD_TYPE_JPEG or self.__all_payloads:
+                data = await readexactly(payload_size)
+                if padding_size != 0:
+                    await readexactly(padding_size)
+                REGISTRY.inc("liveview_frames_total")
+                REGISTRY.inc("liveview_bytes_total", payload_size)
+                self.__fps.add()
+                self.__byte_rate.add(payload_size)
+                return LiveviewFrame(payload_type, sequence_number, timestamp, data)
+            await readexactly(payload_size + padding_size)
+
+
+class LatestFrameBuffer(object):
+    """One slot buffer between a liveview producer and a slower consumer
+
+    put never blocks: a frame which has not been consumed yet is replaced
+    by the newest one and counted as dropped. get waits for a frame and
+    returns None once the buffer is closed and empty.
+    """
+
+    def __init__(self):
+        self.__frame = None
+        self.__closed = False
+        self.__event = asyncio.Event()
+        self.__dropped = 0
+
+    def put(self, frame):
+        if self.__frame is not None:
+            self.__dropped += 1
+            REGISTRY.inc("liveview_dropped_frames_total")
+        self.__frame = frame
+        self.__event.set()
+
+    async def get(self):
+        while self.__frame is None and not self.__closed:
+            self.__event.clear()
+            await self.__event.wait()
+        frame = self.__frame
+        self.__frame = None
+        return frame
+
+    def close(self):
+        self.__closed = True
+        self.__event.set()
+
+    def get_dropped_count(self):
+        return self.__dropped
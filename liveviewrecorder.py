@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+
+from collections import namedtuple
+import logging
+import mmap
+import queue
+from struct import Struct
+import threading
+
+from liveview import LiveviewFrame, PAYLOAD_TYPE_JPEG
+from metrics import REGISTRY
+
+logger = logging.getLogger("cameraremote")
+
+# a recording is made of two files: the jpeg payloads appended one after the
+# other (which is a raw mjpeg stream) and an index with one fixed size entry
+# per frame
+INDEX_SUFFIX = ".idx"
+INDEX_ENTRY = Struct(">QIIH")
+
+IndexEntry = namedtuple(
+    "IndexEntry",
+    ["offset", "length", "timestamp", "sequence_number"]
+)
+
+# frames waiting to be written, the newer ones are dropped beyond
+DEFAULT_MAX_PENDING_FRAMES = 64
+
+
+class LiveviewRecorder(object):
+    """Appends liveview frames to a recording
+
+    Files are written by a single worker thread so that record never
+    blocks the event loop, frames are written in the order they are
+    recorded. When the disk does not keep up, at most max_pending frames
+    wait for the thread and the next ones are dropped and counted.
+    """
+
+    def __init__(self, path, max_pending=DEFAULT_MAX_PENDING_FRAMES):
+        self.__path = path
+        self.__data_fd = open(path, "wb")
+        self.__index_fd = open(path + INDEX_SUFFIX, "wb")
+        self.__offset = 0
+        self.__frames = queue.Queue(max_pending)
+        self.__dropped = 0
+        self.__closed = False
+        self.__thread = threading.Thread(target=self.__write_frames, daemon=True)
+        self.__thread.start()
+
+    def get_path(self):
+        return self.__path
+
+    def get_dropped_count(self):
+        return self.__dropped
+
+    def __write(self, frame):
+        length = len(frame.data)
+        self.__data_fd.write(frame.data)
+        self.__index_fd.write(
+            INDEX_ENTRY.pack(self.__offset, length, frame.timestamp, frame.sequence_number)
+        )
+        self.__offset += length
+
+    def __write_frames(self):
+        failed = False
+        while True:
+            frame = self.__frames.get()
+            if frame is None:
+                break
+            if failed:
+                # still emptied so that close never waits
+                continue
+            try:
+                self.__write(frame)
+            except OSError as e:
+                logger.error("cannot write %s: %s" % (self.__path, str(e)))
+                failed = True
+        self.__data_fd.close()
+        self.__index_fd.close()
+
+    def record(self, frame):
+        if self.__closed:
+            return
+        try:
+            self.__frames.put_nowait(frame)
+        except queue.Full:
+            self.__dropped += 1
+            REGISTRY.inc("liveview_recorder_dropped_frames_total")
+
+    def close(self):
+        """Closes the files once the pending frames are written"""
+        if self.__closed:
+            return
+        self.__closed = True
+        # waits for one frame at most to be written when the queue is full
+        self.__frames.put(None)
+
+
+class LiveviewRecording(object):
+    """Random access to the frames of a recording
+
+    The index is memory mapped, accessing any frame or searching a
+    timestamp does not need to read the recording.
+    """
+
+    def __init__(self, path):
+        self.__data_fd = open(path, "rb")
+        with open(path + INDEX_SUFFIX, "rb") as index_fd:
+            try:
+                self.__index = mmap.mmap(index_fd.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # empty index
+                self.__index = b""
+        self.__length = len(self.__index) // INDEX_ENTRY.size
+
+    def __len__(self):
+        return self.__length
+
+    def get_entry(self, index):
+        if index < 0:
+            index += self.__length
+        if not 0 <= index < self.__length:
+            raise IndexError("frame index out of range")
+        return IndexEntry(*INDEX_ENTRY.unpack_from(self.__index, index * INDEX_ENTRY.size))
+
+    def __getitem__(self, index):
+        entry = self.get_entry(index)
+        self.__data_fd.seek(entry.offset)
+        data = self.__data_fd.read(entry.length)
+        return LiveviewFrame(PAYLOAD_TYPE_JPEG, entry.sequence_number, entry.timestamp, data)
+
+    def find_timestamp(self, timestamp):
+        """Returns the index of the first frame whose timestamp is not lower
+        than timestamp"""
+        low, high = 0, self.__length
+        while low < high:
+            middle = (low + high) // 2
+            if self.get_entry(middle).timestamp < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def export(self, fd, start=0, stop=None):
+        """Writes the frames [start:stop] to fd as a raw mjpeg stream"""
+        if stop is None:
+            stop = self.__length
+        if start >= stop:
+            return
+        first = self.get_entry(start)
+        last = self.get_entry(stop - 1)
+        self.__data_fd.seek(first.offset)
+        remaining = last.offset + last.length - first.offset
+        while remaining > 0:
+            chunk = self.__data_fd.read(min(remaining, 1024 * 1024))
+            if not chunk:
+                break
+            fd.write(chunk)
+            remaining -= len(chunk)
+
+    def close(self):
+        if isinstance(self.__index, mmap.mmap):
+            self.__index.close()
+        self.__data_fd.close()
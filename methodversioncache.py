@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+
+from utils import cache_path, read_json_file, write_json_file
+
+
+class MethodVersionCache(object):
+    """Method version tables resolved by CameraRemoteApi.initial_checks,
+    kept on disk and indexed by camera model, application and api version"""
+
+    def __init__(self, path=None):
+        self.__path = path if path is not None else cache_path("method_versions.json")
+        self.__tables = read_json_file(self.__path, {})
+
+    @staticmethod
+    def make_key(model, application_name, application_version, api_version):
+        return "%s/%s/%s/%s" % (model or "", application_name, application_version, api_version)
+
+    def get(self, key):
+        """Returns the method -> version dictionary or None"""
+        return self.__tables.get(key)
+
+    def update(self, key, method_versions):
+        self.__tables[key] = method_versions
+        write_json_file(self.__path, self.__tables)
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+from bisect import bisect_left
+import logging
+import time
+
+logger = logging.getLogger("cameraremote")
+
+METRICS_PREFIX = "cameraremote_"
+
+# histogram bucket upper bounds (seconds)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# window over which the rate gauges are computed (seconds)
+RATE_WINDOW = 1.0
+
+
+def labels_key(labels):
+    if not labels:
+        return ()
+    return tuple(sorted(labels.items()))
+
+
+def format_labels(key, extra=()):
+    items = key + tuple(extra)
+    if not items:
+        return ""
+    return "{" + ",".join('%s="%s"' % (name, str(value).replace('"', '\\"')) for name, value in items) + "}"
+
+
+class Histogram(object):
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self):
+        cumulative = []
+        total = 0
+        for bucket, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            cumulative.append((bucket, total))
+        return {"buckets": cumulative, "sum": self.sum, "count": self.count}
+
+
+class RateGauge(object):
+    """Sets a gauge to the rate of the amounts added, per second"""
+
+    def __init__(self, registry, name, labels=None):
+        self.__registry = registry
+        self.__name = name
+        self.__labels = labels
+        self.__amount = 0
+        self.__start = time.monotonic()
+
+    def add(self, amount=1):
+        self.__amount += amount
+        now = time.monotonic()
+        elapsed = now - self.__start
+        if elapsed >= RATE_WINDOW:
+            self.__registry.set(self.__name, self.__amount / elapsed, self.__labels)
+            self.__amount = 0
+            self.__start = now
+
+
+class MetricsRegistry(object):
+    """Counters, gauges and histograms indexed by name and labels"""
+
+    def __init__(self):
+        self.__counters = {}
+        self.__gauges = {}
+        self.__histograms = {}
+
+    def inc(self, name, amount=1, labels=None):
+        key = (name, labels_key(labels))
+        self.__counters[key] = self.__counters.get(key, 0) + amount
+
+    def set(self, name, value, labels=None):
+        self.__gauges[(name, labels_key(labels))] = value
+
+    def add(self, name, amount, labels=None):
+        key = (name, labels_key(labels))
+        self.__gauges[key] = self.__gauges.get(key, 0) + amount
+
+    def observe(self, name, value, labels=None):
+        key = (name, labels_key(labels))
+        try:
+            histogram = self.__histograms[key]
+        except KeyError:
+            histogram = self.__histograms[key] = Histogram()
+        histogram.observe(value)
+
+    def snapshot(self):
+        """Returns the metrics as a dictionary: kind -> name -> list of
+        (labels, value)"""
+        snapshot = {"counters": {}, "gauges": {}, "histograms": {}}
+        for kind, metrics in (("counters", self.__counters), ("gauges", self.__gauges)):
+            for (name, key), value in sorted(metrics.items()):
+                snapshot[kind].setdefault(name, []).append((dict(key), value))
+        for (name, key), histogram in sorted(self.__histograms.items(), key=lambda item: item[0]):
+            snapshot["histograms"].setdefault(name, []).append((dict(key), histogram.snapshot()))
+        return snapshot
+
+    def exposition(self):
+        """Returns the metrics in the prometheus text format"""
+        lines = []
+        for kind, type_, metrics in (("counters", "counter", self.__counters),
+                                     ("gauges", "gauge", self.__gauges)):
+            current_name = None
+            for (name, key), value in sorted(metrics.items()):
+                if name != current_name:
+                    lines.append("# TYPE %s%s %s" % (METRICS_PREFIX, name, type_))
+                    current_name = name
+                lines.append("%s%s%s %s" % (METRICS_PREFIX, name, format_labels(key), repr(value)))
+        current_name = None
+        for (name, key), histogram in sorted(self.__histograms.items(), key=lambda item: item[0]):
+            if name != current_name:
+                lines.append("# TYPE %s%s histogram" % (METRICS_PREFIX, name))
+                current_name = name
+            for bucket, count in histogram.snapshot()["buckets"]:
+                bound = "+Inf" if bucket == float("inf") else repr(bucket)
+                lines.append("%s%s_bucket%s %d" %
+                             (METRICS_PREFIX, name, format_labels(key, [("le", bound)]), count))
+            lines.append("%s%s_sum%s %s" % (METRICS_PREFIX, name, format_labels(key), repr(histogram.sum)))
+            lines.append("%s%s_count%s %d" % (METRICS_PREFIX, name, format_labels(key), histogram.count))
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+async def start_metrics_server(host="127.0.0.1", port=9100, registry=REGISTRY):
+    """Serves the text exposition of the metrics on http://host:port/metrics"""
+    import asyncio
+    from aiohttp import web
+
+    async def metrics_handler(request):
+        return web.Response(text=registry.exposition(), content_type="text/plain")
+
+    loop = asyncio.get_event_loop()
+    app = web.Application(loop=loop)
+    app.router.add_route("GET", "/metrics", metrics_handler)
+    server = await loop.create_server(app.make_handler(), host, port)
+    logger.info("metrics served on http://%s:%d/metrics" % (host, port))
+    return server
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+from collections import OrderedDict
+import logging
+import os
+
+from utils import read_file, write_file
+
+logger = logging.getLogger("cameraremote")
+
+DEFAULT_MAX_BYTES = 128 * 1024 * 1024
+
+# renditions kept per picture (the sizes of the views showing it)
+MAX_RENDITIONS = 2
+
+
+class CacheEntry(object):
+
+    def __init__(self, data):
+        self.data = data
+        # size -> (rendition, bytes)
+        self.renditions = OrderedDict()
+        self.size = len(data)
+
+
+class PictureCache(object):
+    """Compressed pictures and their scaled renditions, least recently
+    used first out
+
+    The entries are kept in memory within max_bytes (compressed data plus
+    renditions, whose size is given when they are added). With a
+    directory, evicted pictures stay on disk there, written in the default
+    executor, and fetch reads them back. Renditions are opaque objects
+    indexed by a hashable size.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, directory=None):
+        self.__max_bytes = max_bytes
+        self.__directory = directory
+        self.__entries = OrderedDict()
+        self.__bytes = 0
+        # evicted pictures being written to the directory, key -> data
+        self.__spilling = {}
+        self.__spill_futures = set()
+        self.__stats = {"hits": 0, "misses": 0, "rendition_hits": 0, "rendition_misses": 0,
+                        "disk_reads": 0, "evictions": 0}
+
+    def __contains__(self, key):
+        return key in self.__entries
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def get_stats(self):
+        stats = dict(self.__stats)
+        stats["entries"] = len(self.__entries)
+        stats["bytes"] = self.__bytes
+        return stats
+
+    def __disk_path(self, key):
+        return os.path.join(self.__directory, key)
+
+    def __evict(self):
+        # the most recent entry stays, even alone over the budget
+        while self.__bytes > self.__max_bytes and len(self.__entries) > 1:
+            key, entry = self.__entries.popitem(last=False)
+            self.__bytes -= entry.size
+            self.__stats["evictions"] += 1
+            if self.__directory is not None and key not in self.__spilling and \
+                    not os.path.exists(self.__disk_path(key)):
+                self.__spill(key, entry.data)
+
+    def __spill(self, key, data):
+        self.__spilling[key] = data
+        future = asyncio.get_event_loop().run_in_executor(
+            None, write_file, self.__disk_path(key), data
+        )
+        self.__spill_futures.add(future)
+
+        def spilled(f):
+            self.__spill_futures.discard(f)
+            if self.__spilling.get(key) is data:
+                del self.__spilling[key]
+            if f.exception() is not None:
+                logger.error("cannot write %s: %s" % (self.__disk_path(key), str(f.exception())))
+        future.add_done_callback(spilled)
+
+    async def join(self):
+        """Waits for the evicted pictures to be written"""
+        while self.__spill_futures:
+            await asyncio.wait(list(self.__spill_futures))
+
+    def put(self, key, data):
+        """Adds the compressed data of a picture, dropping its renditions if
+        it was already there"""
+        entry = self.__entries.pop(key, None)
+        if entry is not None:
+            self.__bytes -= entry.size
+        entry = CacheEntry(data)
+        self.__entries[key] = entry
+        self.__bytes += entry.size
+        self.__evict()
+
+    def get(self, key):
+        """Returns the compressed data of a picture in memory or None"""
+        entry = self.__entries.get(key)
+        if entry is None:
+            self.__stats["misses"] += 1
+            return None
+        self.__stats["hits"] += 1
+        self.__entries.move_to_end(key)
+        return entry.data
+
+    async def fetch(self, key):
+        """Same as get, reading the picture from the disk directory when it
+        is not in memory"""
+        data = self.get(key)
+        if data is not None or self.__directory is None:
+            return data
+        data = self.__spilling.get(key)
+        if data is not None:
+            # not written yet
+            self.put(key, data)
+            return data
+        path = self.__disk_path(key)
+        if not os.path.exists(path):
+            return None
+        data = await asyncio.get_event_loop().run_in_executor(None, read_file, path)
+        self.__stats["disk_reads"] += 1
+        self.put(key, data)
+        return data
+
+    def get_rendition(self, key, size):
+        entry = self.__entries.get(key)
+        rendition = entry.renditions.get(size) if entry is not None else None
+        if rendition is None:
+            self.__stats["rendition_misses"] += 1
+            return None
+        self.__stats["rendition_hits"] += 1
+        self.__entries.move_to_end(key)
+        entry.renditions.move_to_end(size)
+        return rendition[0]
+
+    def put_rendition(self, key, size, rendition, nbytes):
+        """Adds a rendition of a picture already in the cache"""
+        entry = self.__entries.get(key)
+        if entry is None:
+            return
+        previous = entry.renditions.pop(size, None)
+        if previous is not None:
+            entry.size -= previous[1]
+            self.__bytes -= previous[1]
+        entry.renditions[size] = (rendition, nbytes)
+        entry.size += nbytes
+        self.__bytes += nbytes
+        while len(entry.renditions) > MAX_RENDITIONS:
+            _, (_, dropped_bytes) = entry.renditions.popitem(last=False)
+            entry.size -= dropped_bytes
+            self.__bytes -= dropped_bytes
+        self.__entries.move_to_end(key)
+        self.__evict()
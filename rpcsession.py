@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from aiohttp import web
+import argparse
+import asyncio
+import base64
+from collections import deque
+import json
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger("cameraremote")
+
+# error returned for the requests which are not in the session
+NO_SUCH_METHOD_ERROR = [12, "No Such Method"]
+
+# a session file has one json list per request:
+#   [start offset, duration, purpose, request, response]
+# offsets and durations are in seconds, request and response are the json
+# objects exchanged with the camera. a response body which is not json (an
+# html error page of the camera for instance) is kept as a base64 string
+
+
+class RpcSessionRecorder(object):
+    """Appends the requests sent by a CameraRemoteApi and the responses
+    to a session file
+
+    The bodies are checked and the lines written by a thread, record never
+    blocks the event loop.
+    """
+
+    def __init__(self, path):
+        self.__path = path
+        # line buffered: a crash loses at most the request in progress
+        self.__fd = open(path, "a", buffering=1)
+        self.__start = time.perf_counter()
+        self.__records = queue.Queue()
+        self.__thread = threading.Thread(target=self.__write_records, daemon=True)
+        self.__thread.start()
+
+    def get_path(self):
+        return self.__path
+
+    def __write_records(self):
+        failed = False
+        while True:
+            record = self.__records.get()
+            if record is None:
+                break
+            if failed:
+                continue
+            offset, duration, purpose, request, response = record
+            try:
+                response = json.loads(response.decode("utf-8"))
+            except ValueError:
+                response = base64.b64encode(response).decode("ascii")
+            line = json.dumps([offset, duration, purpose, json.loads(request), response])
+            try:
+                self.__fd.write(line + "\n")
+            except OSError as e:
+                logger.error("cannot write %s: %s" % (self.__path, str(e)))
+                failed = True
+        self.__fd.close()
+
+    def record(self, start, duration, purpose, request, response):
+        """Queues a request (json string) and its response (raw body)"""
+        self.__records.put((round(start - self.__start, 6), round(duration, 6), purpose, request, response))
+
+    def close(self):
+        """Waits for the queued requests to be written and closes the file"""
+        self.__records.put(None)
+        self.__thread.join()
+
+
+def read_session(path):
+    """Returns the (offset, duration, purpose, request, response) tuples of
+    a session file, response being bytes when the body was not json"""
+    session = []
+    with open(path) as fd:
+        for line in fd:
+            if not line.strip():
+                continue
+            offset, duration, purpose, request, response = json.loads(line)
+            if isinstance(response, str):
+                response = base64.b64decode(response)
+            session.append((offset, duration, purpose, request, response))
+    return session
+
+
+def load_event_results(path):
+    """Returns the results of the getEvent calls of a session file"""
+    return [
+        response["result"]
+        for _, _, _, request, response in read_session(path)
+        if request["method"] == "getEvent" and isinstance(response, dict) and "result" in response
+    ]
+
+
+def request_key(request):
+    return (request["method"], request.get("version"),
+            json.dumps(request.get("params", []), sort_keys=True))
+
+
+class RpcSessionReplayer(object):
+    """Serves the responses of a recorded session on the camera service url
+
+    Each request gets the next recorded response to the same method with
+    the same parameters (the last one again once they are exhausted),
+    after its recorded duration divided by speed; a speed of 0 answers
+    immediately. Events long polling therefore follows the original timing.
+    Liveview and postview urls of the responses still point to the
+    recorded camera. The bodies which were not json are served unchanged.
+    """
+
+    def __init__(self, path, host="127.0.0.1", port=8080, speed=1.0):
+        self.__host = host
+        self.__port = port
+        self.__speed = speed
+        self.__responses = {}
+        for _, duration, _, request, response in read_session(path):
+            self.__responses.setdefault(request_key(request), deque()).append((duration, response))
+        self.__server = None
+
+    def get_endpoint_url(self):
+        return "http://%s:%d/sony/camera" % (self.__host, self.__port)
+
+    async def start(self):
+        loop = asyncio.get_event_loop()
+        app = web.Application(loop=loop)
+        app.router.add_route("POST", "/sony/camera", self.__camera_handler)
+        self.__server = await loop.create_server(app.make_handler(), self.__host, self.__port)
+        logger.info("replaying session on %s" % (self.get_endpoint_url(),))
+
+    async def stop(self):
+        if self.__server is not None:
+            self.__server.close()
+            await self.__server.wait_closed()
+            self.__server = None
+
+    def __next_response(self, request):
+        responses = self.__responses.get(request_key(request))
+        if not responses:
+            return 0, {"error": NO_SUCH_METHOD_ERROR}
+        if len(responses) > 1:
+            return responses.popleft()
+        return responses[0]
+
+    async def __camera_handler(self, request):
+        data = await request.json()
+        duration, response = self.__next_response(data)
+        if self.__speed > 0:
+            await asyncio.sleep(duration / self.__speed)
+        if isinstance(response, bytes):
+            # served back as the camera sent it
+            return web.Response(body=response)
+        if response.get("error") == NO_SUCH_METHOD_ERROR:
+            logger.warning("%s not in the session" % (data["method"],))
+        response = dict(response, id=data.get("id"))
+        return web.Response(body=json.dumps(response).encode("utf-8"), content_type="application/json")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replays a recorded camera session")
+    parser.add_argument("session", help="file recorded with --record-session")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="replay speed factor, 0 for no delay")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)-8s %(message)s")
+    loop = asyncio.get_event_loop()
+    replayer = RpcSessionReplayer(args.session, args.host, args.port, args.speed)
+    loop.run_until_complete(replayer.start())
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loop.run_until_complete(replayer.stop())
+        loop.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+from collections import deque, namedtuple
+import logging
+import time
+
+# number of requests kept by default
+RPC_TRACE_SIZE = 256
+
+# start is a time.perf_counter value, duration in seconds, sizes in bytes,
+# outcome is "ok", "timeout" or an error message
+RpcRecord = namedtuple(
+    "RpcRecord",
+    ["method", "request_id", "start", "duration", "request_size", "response_size", "outcome"]
+)
+
+
+class RpcTrace(object):
+    """Ring buffer of the last requests sent to a camera
+
+    Recording only appends a tuple; records are formatted when the trace
+    is dumped.
+    """
+
+    def __init__(self, size=RPC_TRACE_SIZE):
+        self.__records = deque(maxlen=size)
+        # converts the perf_counter start times to wall clock times
+        self.__clock_offset = time.time() - time.perf_counter()
+
+    def __len__(self):
+        return len(self.__records)
+
+    def record(self, method, request_id, start, duration, request_size, response_size, outcome):
+        self.__records.append((method, request_id, start, duration, request_size, response_size, outcome))
+
+    def get_records(self):
+        return [RpcRecord(*record) for record in self.__records]
+
+    def clear(self):
+        self.__records.clear()
+
+    def format(self):
+        lines = []
+        for method, request_id, start, duration, request_size, response_size, outcome in self.__records:
+            wall_time = start + self.__clock_offset
+            lines.append("%s.%03d %6d %-28s %9.1f ms %7d > %7s < %s" % (
+                time.strftime("%H:%M:%S", time.localtime(wall_time)),
+                int(wall_time * 1000) % 1000,
+                request_id,
+                method,
+                duration * 1000,
+                request_size,
+                response_size if response_size is not None else "-",
+                outcome
+            ))
+        return "\n".join(lines)
+
+    def dump(self, logger, level=logging.ERROR):
+        if self.__records:
+            logger.log(level, "last %d requests:\n%s" % (len(self.__records), self.format()))
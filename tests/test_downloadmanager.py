@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+
+import aiohttp
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from burstdownloader import BurstDownloader
+import downloadmanager
+from downloadmanager import DownloadManager, PARTIAL_SUFFIX
+
+PICTURE = bytes(range(256)) * 1024
+
+
+class FakeContent(object):
+
+    def __init__(self, data, fail_after=None, blocked=None):
+        self.__data = data
+        self.__position = 0
+        self.__fail_after = fail_after
+        self.__blocked = blocked
+
+    async def read(self, size):
+        if self.__blocked is not None:
+            await self.__blocked.wait()
+        if self.__fail_after is not None and self.__position >= self.__fail_after:
+            raise aiohttp.ClientError("connection lost")
+        chunk = self.__data[self.__position:self.__position + size]
+        self.__position += len(chunk)
+        return chunk
+
+
+class FakeResponse(object):
+
+    def __init__(self, status, data, **kwargs):
+        self.status = status
+        self.headers = {"CONTENT-TYPE": "image/jpeg", "CONTENT-LENGTH": str(len(data))}
+        self.content = FakeContent(data, **kwargs)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+
+class FakeHttpPool(object):
+    """Serves PICTURE for every url, the ones in fail_urls lose the
+    connection after fail_after bytes, the ones in blocked_urls wait for
+    the blocked event before sending their body"""
+
+    def __init__(self, fail_urls=(), fail_after=0, blocked_urls=()):
+        self.requests = []
+        self.blocked = asyncio.Event()
+        self.__fail_urls = set(fail_urls)
+        self.__fail_after = fail_after
+        self.__blocked_urls = set(blocked_urls)
+
+    def get_limit(self, purpose):
+        return 2
+
+    def get(self, purpose, url, headers=None):
+        self.requests.append((url, headers))
+        if headers is not None:
+            offset = int(headers["RANGE"][len("bytes="):-1])
+            return FakeResponse(206, PICTURE[offset:])
+        kwargs = {}
+        if url in self.__fail_urls:
+            self.__fail_urls.discard(url)
+            kwargs["fail_after"] = self.__fail_after
+        if url in self.__blocked_urls:
+            kwargs["blocked"] = self.blocked
+        return FakeResponse(200, PICTURE, **kwargs)
+
+
+class DownloadTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.directory = tempfile.mkdtemp()
+        self.retry_delay = downloadmanager.RETRY_DELAY
+        downloadmanager.RETRY_DELAY = 0
+
+    def tearDown(self):
+        downloadmanager.RETRY_DELAY = self.retry_delay
+        # lets the cancelled tasks end
+        pending = asyncio.all_tasks(self.loop)
+        self.loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+        self.loop.close()
+        asyncio.set_event_loop(None)
+        shutil.rmtree(self.directory)
+
+    def run_async(self, coroutine):
+        return self.loop.run_until_complete(asyncio.wait_for(coroutine, 5))
+
+    def read_picture(self, name):
+        with open(os.path.join(self.directory, name), "rb") as fd:
+            return fd.read()
+
+
+class DownloadManagerTest(DownloadTestCase):
+
+    def test_resume(self):
+        pool = FakeHttpPool(fail_urls=["http://camera/a.jpg"], fail_after=64 * 1024)
+        manager = DownloadManager(pool, self.directory)
+        manager.start()
+        path = self.run_async(manager.download("http://camera/a.jpg"))
+        manager.close()
+        self.assertEqual(path, os.path.join(self.directory, "a.jpg"))
+        self.assertEqual(self.read_picture("a.jpg"), PICTURE)
+        self.assertEqual(pool.requests, [
+            ("http://camera/a.jpg", None),
+            ("http://camera/a.jpg", {"RANGE": "bytes=%d-" % (64 * 1024,)}),
+        ])
+        self.assertEqual(manager.get_stats()["resumed"], 1)
+
+    def test_dedup(self):
+        pool = FakeHttpPool()
+        manager = DownloadManager(pool, self.directory)
+        manager.start()
+        first = manager.download("http://camera/a.jpg")
+        second = manager.download("http://camera/a.jpg")
+        self.assertIs(first, second)
+        self.run_async(first)
+        manager.close()
+        self.assertEqual(len(pool.requests), 1)
+        stats = manager.get_stats()
+        self.assertEqual((stats["downloaded"], stats["shared"]), (1, 1))
+
+    def test_url_reused_while_downloading(self):
+        pool = FakeHttpPool(blocked_urls=["http://camera/a.jpg"])
+        manager = DownloadManager(pool, self.directory)
+        manager.start()
+        first = manager.download("http://camera/a.jpg")
+
+        async def download_again():
+            while not pool.requests:
+                await asyncio.sleep(0)
+            # a new picture at the same url
+            second = manager.download("http://camera/a.jpg")
+            self.assertIsNot(first, second)
+            self.assertIs(manager.download("http://camera/a.jpg"), second)
+            pool.blocked.set()
+            return await asyncio.gather(first, second)
+
+        paths = self.run_async(download_again())
+        manager.close()
+        self.assertEqual(paths, [os.path.join(self.directory, "a.jpg")] * 2)
+        self.assertEqual(len(pool.requests), 2)
+        stats = manager.get_stats()
+        self.assertEqual((stats["downloaded"], stats["shared"], stats["pending"]), (2, 1, 0))
+
+    def test_cancel(self):
+        pool = FakeHttpPool(blocked_urls=["http://camera/a.jpg"])
+        manager = DownloadManager(pool, self.directory)
+        manager.start()
+        future = manager.download("http://camera/a.jpg")
+
+        async def cancel():
+            while not pool.requests:
+                await asyncio.sleep(0)
+            manager.cancel("http://camera/a.jpg")
+            await asyncio.wait([future])
+            # the worker is still there for the next downloads
+            return await manager.download("http://camera/b.jpg")
+
+        path = self.run_async(cancel())
+        manager.close()
+        self.assertTrue(future.cancelled())
+        self.assertEqual(path, os.path.join(self.directory, "b.jpg"))
+        self.assertFalse(os.path.exists(os.path.join(self.directory, "a.jpg")))
+        self.assertTrue(os.path.exists(os.path.join(self.directory, "a.jpg" + PARTIAL_SUFFIX)))
+        self.assertEqual(manager.get_stats()["cancelled"], 1)
+
+
+class BurstDownloaderTest(DownloadTestCase):
+
+    def start(self, pool):
+        self.manager = DownloadManager(pool, self.directory)
+        self.manager.start()
+        self.downloaded = []
+        downloader = BurstDownloader(self.manager, workers=2, queue_size=2,
+                                     callback=self.downloaded.append)
+        downloader.start()
+        return downloader
+
+    def stop(self, downloader):
+        downloader.close()
+        self.manager.close()
+
+    def cont_shooting(self, downloader, names):
+        callback = downloader.get_event_callbacks()["contShooting"]
+        callback({"contShootingUrl": [{"postviewUrl": "http://camera/" + name} for name in names]})
+
+    def test_dedup(self):
+        pool = FakeHttpPool()
+        downloader = self.start(pool)
+        self.cont_shooting(downloader, ["a.jpg", "b.jpg", "a.jpg", "c.jpg", "d.jpg"])
+        self.cont_shooting(downloader, ["d.jpg", "e.jpg"])
+        self.run_async(downloader.join())
+        self.stop(downloader)
+        stats = downloader.get_stats()
+        self.assertEqual((stats["downloaded"], stats["duplicates"]), (5, 2))
+        self.assertEqual(len(pool.requests), 5)
+        self.assertEqual(sorted(os.path.basename(path) for path in self.downloaded),
+                         ["a.jpg", "b.jpg", "c.jpg", "d.jpg", "e.jpg"])
+
+    def test_same_urls_in_two_bursts(self):
+        pool = FakeHttpPool()
+        downloader = self.start(pool)
+        downloader.start_burst()
+        self.cont_shooting(downloader, ["a.jpg", "a.jpg"])
+        self.run_async(downloader.join())
+        downloader.start_burst()
+        self.cont_shooting(downloader, ["a.jpg"])
+        self.run_async(downloader.join())
+        self.stop(downloader)
+        stats = downloader.get_stats()
+        self.assertEqual((stats["downloaded"], stats["duplicates"]), (2, 1))
+        self.assertEqual(len(pool.requests), 2)
+
+    def test_resume(self):
+        pool = FakeHttpPool(fail_urls=["http://camera/b.jpg"], fail_after=64 * 1024)
+        downloader = self.start(pool)
+        self.cont_shooting(downloader, ["a.jpg", "b.jpg"])
+        self.run_async(downloader.join())
+        self.stop(downloader)
+        self.assertEqual(downloader.get_stats()["downloaded"], 2)
+        self.assertEqual(self.read_picture("b.jpg"), PICTURE)
+        self.assertEqual(self.manager.get_stats()["resumed"], 1)
+
+    def test_cancel(self):
+        pool = FakeHttpPool(blocked_urls=["http://camera/a.jpg"])
+        downloader = self.start(pool)
+        self.cont_shooting(downloader, ["a.jpg", "b.jpg", "c.jpg"])
+
+        async def cancel():
+            while "http://camera/a.jpg" not in [url for url, _ in pool.requests]:
+                await asyncio.sleep(0)
+            self.manager.cancel("http://camera/a.jpg")
+            await downloader.join()
+            # the workers survived the cancellation
+            self.cont_shooting(downloader, ["d.jpg"])
+            await downloader.join()
+
+        self.run_async(cancel())
+        self.stop(downloader)
+        stats = downloader.get_stats()
+        self.assertEqual((stats["downloaded"], stats["cancelled"], stats["failed"]), (3, 1, 0))
+        self.assertEqual(stats["pending"], 0)
+
+    def test_close_keeps_shared_download(self):
+        pool = FakeHttpPool(blocked_urls=["http://camera/a.jpg"])
+        downloader = self.start(pool)
+        self.cont_shooting(downloader, ["a.jpg"])
+        future = self.manager.download("http://camera/a.jpg")
+
+        async def close():
+            while not pool.requests:
+                await asyncio.sleep(0)
+            downloader.close()
+            pool.blocked.set()
+            return await future
+
+        path = self.run_async(close())
+        self.manager.close()
+        self.assertEqual(path, os.path.join(self.directory, "a.jpg"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from liveview import LiveviewFrame, PAYLOAD_TYPE_JPEG
+from liveviewrecorder import INDEX_ENTRY, INDEX_SUFFIX, LiveviewRecorder, LiveviewRecording
+
+
+class BlockingData(bytes):
+    """Payload whose write waits for the released event"""
+
+    released = threading.Event()
+
+    def __len__(self):
+        self.released.wait()
+        return bytes.__len__(self)
+
+
+def make_frame(sequence_number, data=None):
+    if data is None:
+        data = b"\xff\xd8 frame %d \xff\xd9" % (sequence_number,)
+    return LiveviewFrame(PAYLOAD_TYPE_JPEG, sequence_number, sequence_number * 40, data)
+
+
+class LiveviewRecorderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "liveview.mjpeg")
+        BlockingData.released.clear()
+
+    def tearDown(self):
+        BlockingData.released.set()
+        shutil.rmtree(self.directory)
+
+    def wait_frames(self, count):
+        # the files are closed by the writer thread
+        deadline = time.monotonic() + 5
+        while os.path.getsize(self.path + INDEX_SUFFIX) < count * INDEX_ENTRY.size:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+
+    def test_record(self):
+        recorder = LiveviewRecorder(self.path)
+        frames = [make_frame(i) for i in range(5)]
+        for frame in frames:
+            recorder.record(frame)
+        recorder.close()
+        self.wait_frames(len(frames))
+        recording = LiveviewRecording(self.path)
+        try:
+            self.assertEqual(len(recording), len(frames))
+            self.assertEqual([recording[i] for i in range(len(frames))], frames)
+            self.assertEqual(recording.find_timestamp(81), 3)
+        finally:
+            recording.close()
+        self.assertEqual(recorder.get_dropped_count(), 0)
+
+    def test_drop_when_full(self):
+        recorder = LiveviewRecorder(self.path, max_pending=2)
+        recorder.record(make_frame(0, BlockingData(b"blocked")))
+        # the thread may not have taken the first frame yet
+        for i in range(1, 6):
+            recorder.record(make_frame(i))
+        self.assertIn(recorder.get_dropped_count(), (3, 4))
+        BlockingData.released.set()
+        recorder.close()
+        recorded = 6 - recorder.get_dropped_count()
+        self.wait_frames(recorded)
+        recording = LiveviewRecording(self.path)
+        try:
+            self.assertEqual([recording[i].sequence_number for i in range(len(recording))],
+                             list(range(recorded)))
+        finally:
+            recording.close()
+        recorder.record(make_frame(6))
+        self.assertEqual(recorder.get_dropped_count(), 6 - recorded)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from picturecache import MAX_RENDITIONS, PictureCache
+
+
+class PictureCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+        shutil.rmtree(self.directory)
+
+    def run_async(self, coroutine):
+        return self.loop.run_until_complete(asyncio.wait_for(coroutine, 5))
+
+    def test_byte_accounting(self):
+        cache = PictureCache(100)
+        cache.put("a", b"x" * 10)
+        cache.put("b", b"x" * 20)
+        cache.put_rendition("a", (1, 1), "a1", 5)
+        self.assertEqual(cache.get_stats()["bytes"], 35)
+        # a rendition replaced, a picture put again without its renditions
+        cache.put_rendition("a", (1, 1), "a1 bis", 7)
+        self.assertEqual(cache.get_stats()["bytes"], 37)
+        cache.put("a", b"x" * 12)
+        self.assertEqual(cache.get_stats()["bytes"], 32)
+        self.assertIsNone(cache.get_rendition("a", (1, 1)))
+        # renditions of a missing picture are ignored
+        cache.put_rendition("c", (1, 1), "c1", 5)
+        self.assertEqual((len(cache), cache.get_stats()["bytes"]), (2, 32))
+
+    def test_lru_order(self):
+        cache = PictureCache(30)
+        cache.put("a", b"x" * 10)
+        cache.put("b", b"x" * 10)
+        cache.put("c", b"x" * 10)
+        # a is used, b is the least recently used one
+        self.assertEqual(cache.get("a"), b"x" * 10)
+        cache.put("d", b"x" * 10)
+        self.assertNotIn("b", cache)
+        self.assertIn("a", cache)
+        # a rendition access counts as a use too
+        cache.put_rendition("c", (1, 1), "c1", 1)
+        self.assertEqual(cache.get_rendition("c", (1, 1)), "c1")
+        cache.put("e", b"x" * 9)
+        self.assertNotIn("a", cache)
+        self.assertIn("c", cache)
+        stats = cache.get_stats()
+        self.assertEqual((stats["evictions"], stats["bytes"]), (2, 30))
+
+    def test_most_recent_entry_stays(self):
+        cache = PictureCache(10)
+        cache.put("a", b"x" * 5)
+        cache.put("b", b"x" * 50)
+        self.assertEqual(len(cache), 1)
+        self.assertIn("b", cache)
+
+    def test_rendition_capping(self):
+        cache = PictureCache(1000)
+        cache.put("a", b"x" * 10)
+        for width in range(MAX_RENDITIONS + 2):
+            cache.put_rendition("a", (width, 1), "a%d" % (width,), 10)
+        self.assertEqual(cache.get_stats()["bytes"], 10 + MAX_RENDITIONS * 10)
+        self.assertIsNone(cache.get_rendition("a", (0, 1)))
+        self.assertEqual(cache.get_rendition("a", (MAX_RENDITIONS + 1, 1)),
+                         "a%d" % (MAX_RENDITIONS + 1,))
+
+    def test_rendition_eviction(self):
+        cache = PictureCache(25)
+        cache.put("a", b"x" * 10)
+        cache.put("b", b"x" * 10)
+        # the renditions of b push a out
+        cache.put_rendition("b", (1, 1), "b1", 10)
+        self.assertNotIn("a", cache)
+        self.assertEqual(cache.get_stats()["bytes"], 20)
+
+    def test_disk_spill_and_fetch(self):
+        cache = PictureCache(10, self.directory)
+        cache.put("a.jpg", b"a" * 10)
+        cache.put("b.jpg", b"b" * 10)
+        self.run_async(cache.join())
+        with open(os.path.join(self.directory, "a.jpg"), "rb") as fd:
+            self.assertEqual(fd.read(), b"a" * 10)
+        self.assertIsNone(cache.get("a.jpg"))
+        self.assertEqual(self.run_async(cache.fetch("a.jpg")), b"a" * 10)
+        self.assertEqual(cache.get_stats()["disk_reads"], 1)
+        # read back, b is spilled in turn
+        self.assertIn("a.jpg", cache)
+        self.assertNotIn("b.jpg", cache)
+        self.run_async(cache.join())
+        self.assertTrue(os.path.exists(os.path.join(self.directory, "b.jpg")))
+        self.assertIsNone(self.run_async(cache.fetch("c.jpg")))
+
+    def test_fetch_while_spilling(self):
+        cache = PictureCache(10, self.directory)
+        cache.put("a.jpg", b"a" * 10)
+        cache.put("b.jpg", b"b" * 10)
+        # the write has not run yet, the data comes from memory
+        self.assertEqual(self.run_async(cache.fetch("a.jpg")), b"a" * 10)
+        self.assertEqual(cache.get_stats()["disk_reads"], 0)
+        self.run_async(cache.join())
+
+    def test_no_directory(self):
+        cache = PictureCache(10)
+        cache.put("a.jpg", b"a" * 10)
+        cache.put("b.jpg", b"b" * 10)
+        self.assertIsNone(self.run_async(cache.fetch("a.jpg")))
+        self.assertEqual(os.listdir(self.directory), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
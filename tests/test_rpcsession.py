@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from rpcsession import load_event_results, read_session, RpcSessionRecorder
+
+ERROR_PAGE = b"<html>\r\n<body>503 Service Unavailable</body>\r\n</html>\r\n"
+
+
+class RpcSessionRecorderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "session.jsonl")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_record(self):
+        recorder = RpcSessionRecorder(self.path)
+        start = time.perf_counter()
+        recorder.record(start, 0.5, "event",
+                        '{"method": "getEvent", "params": [true], "id": 1, "version": "1.0"}',
+                        b'{"result": [\n{"type": "availableApiList"}], "id": 1}')
+        recorder.record(start, 0.25, "rpc",
+                        '{"method": "actTakePicture", "params": [], "id": 2, "version": "1.0"}',
+                        ERROR_PAGE)
+        recorder.record(start, 0.1, "rpc",
+                        '{"method": "getEvent", "params": [false], "id": 3, "version": "1.0"}',
+                        b"\xff\xfe not utf-8")
+        recorder.close()
+
+        session = read_session(self.path)
+        self.assertEqual(len(session), 3)
+        _, duration, purpose, request, response = session[0]
+        self.assertEqual((duration, purpose, request["method"]), (0.5, "event", "getEvent"))
+        self.assertEqual(response, {"result": [{"type": "availableApiList"}], "id": 1})
+        self.assertEqual(session[1][4], ERROR_PAGE)
+        self.assertEqual(session[2][4], b"\xff\xfe not utf-8")
+        self.assertEqual(load_event_results(self.path), [[{"type": "availableApiList"}]])
+
+    def test_append(self):
+        for request_id in (1, 2):
+            recorder = RpcSessionRecorder(self.path)
+            recorder.record(time.perf_counter(), 0, "rpc",
+                            '{"method": "getVersions", "params": [], "id": %d, "version": "1.0"}' % (request_id,),
+                            b'{"result": [["1.0"]], "id": %d}' % (request_id,))
+            recorder.close()
+        self.assertEqual([request["id"] for _, _, _, request, _ in read_session(self.path)], [1, 2])
+
+
+if __name__ == "__main__":
+    unittest.main()
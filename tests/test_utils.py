@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from utils import candidate_range, CandidateRange
+
+
+class CandidateRangeTest(unittest.TestCase):
+
+    def test_len(self):
+        self.assertEqual(len(CandidateRange(0, 10, 3)), 4)
+        self.assertEqual(len(CandidateRange(-3, 3, 1)), 7)
+        self.assertEqual(len(CandidateRange(0.0, 1.0, 0.1)), 11)
+        self.assertEqual(len(CandidateRange(0.0, 0.95, 0.1)), 10)
+        self.assertEqual(len(CandidateRange(-3.0, 3.0, 0.3)), 21)
+
+    def test_indexing(self):
+        candidates = CandidateRange(0, 10, 3)
+        self.assertEqual(candidates[0], "0")
+        self.assertEqual(candidates[3], "9")
+        self.assertEqual(candidates[-1], "9")
+        self.assertEqual(candidates[-4], "0")
+        self.assertRaises(IndexError, candidates.__getitem__, 4)
+        self.assertRaises(IndexError, candidates.__getitem__, -5)
+        self.assertEqual(list(candidates), ["0", "3", "6", "9"])
+
+    def test_slice(self):
+        candidates = CandidateRange(-3, 3, 1)
+        self.assertEqual(candidates[1:3], ["-2", "-1"])
+        self.assertEqual(candidates[-2:], ["2", "3"])
+        self.assertEqual(candidates[::3], ["-3", "0", "3"])
+        self.assertEqual(candidates[5:100], ["2", "3"])
+
+    def test_int_membership(self):
+        candidates = CandidateRange(-3, 3, 1)
+        self.assertIn(0, candidates)
+        self.assertIn("-3", candidates)
+        self.assertIn("3", candidates)
+        self.assertNotIn(4, candidates)
+        self.assertNotIn("0.5", candidates)
+        self.assertNotIn(0.5, candidates)
+
+    def test_float_membership(self):
+        candidates = candidate_range("ev", -3.0, 3.0, 0.3)
+        self.assertIn("0.3", candidates)
+        self.assertIn(0.9, candidates)
+        self.assertIn("-3.0", candidates)
+        self.assertIn(3.0, candidates)
+        self.assertNotIn(0.4, candidates)
+        self.assertNotIn(3.3, candidates)
+        for value in candidates:
+            self.assertIn(value, candidates)
+
+    def test_not_numeric_membership(self):
+        candidates = CandidateRange(0.0, 1.0, 0.1)
+        self.assertNotIn("auto", candidates)
+        self.assertNotIn(None, candidates)
+        self.assertNotIn([0.1], candidates)
+
+    def test_empty(self):
+        candidates = CandidateRange(1, 0, 1)
+        self.assertEqual(len(candidates), 0)
+        self.assertEqual(list(candidates), [])
+        self.assertEqual(candidates[:], [])
+        self.assertNotIn(0, candidates)
+        self.assertRaises(IndexError, candidates.__getitem__, 0)
+
+    def test_wrong_step(self):
+        self.assertRaises(ValueError, CandidateRange, 0, 1, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,5 +1,56 @@
 # -*- coding: utf-8 -*-
 
+from functools import lru_cache
+import json
+import logging
+import os
+
+logger = logging.getLogger("cameraremote")
+
+
+def cache_path(file_name):
+    """Returns the path of a file of the application cache directory"""
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(cache_home, "cameraremote", file_name)
+
+
+def read_file(path):
+    """Returns the content of a binary file"""
+    with open(path, "rb") as fd:
+        return fd.read()
+
+
+def read_json_file(path, default):
+    """Returns the content of a json file, default if it does not exist or
+    cannot be read"""
+    try:
+        with open(path) as fd:
+            return json.load(fd)
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError) as e:
+        logger.error("cannot read %s: %s" % (path, str(e)))
+    return default
+
+
+def write_file(path, data):
+    """Writes a binary file, creating its directory"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as fd:
+        fd.write(data)
+
+
+def write_json_file(path, data):
+    """Writes a json file atomically, logs the errors"""
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary_path = path + ".tmp"
+        with open(temporary_path, "w") as fd:
+            json.dump(data, fd, indent=4, sort_keys=True)
+        os.replace(temporary_path, path)
+    except OSError as e:
+        logger.error("cannot write %s: %s" % (path, str(e)))
+
 
 def lower_first_letter(word):
     return word[0].lower() + word[1:]
@@ -9,6 +60,79 @@ def upper_first_letter(word):
     return word[0].upper() + word[1:]
 
 
+# relative to the step of a CandidateRange
+FLOAT_TOLERANCE = 1e-9
+
+
+class CandidateRange(object):
+    """Read only sequence of the values min_, min_ + step, ... up to max_
+
+    Values are given as strings, like the candidates lists sent by the
+    camera, and computed on access.
+    """
+
+    def __init__(self, min_, max_, step):
+        if step <= 0:
+            raise ValueError("\"%s\" : wrong step" % (step,))
+        self.__min = min_
+        self.__max = max_
+        self.__step = step
+        if max_ >= min_:
+            # rounded, float steps do not divide the range exactly
+            count = int(round((max_ - min_) / step))
+            if min_ + count * step > max_ + step * FLOAT_TOLERANCE:
+                count -= 1
+            self.__length = count + 1
+        else:
+            self.__length = 0
+
+    def __len__(self):
+        return self.__length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.__length))]
+        if index < 0:
+            index += self.__length
+        if not 0 <= index < self.__length:
+            raise IndexError("candidate index out of range")
+        return str(self.__min + index * self.__step)
+
+    def __iter__(self):
+        for index in range(self.__length):
+            yield str(self.__min + index * self.__step)
+
+    def __contains__(self, value):
+        if isinstance(value, str):
+            try:
+                value = type(self.__min)(value)
+            except ValueError:
+                return False
+        try:
+            index = round((value - self.__min) / self.__step)
+        except TypeError:
+            return False
+        return 0 <= index < self.__length and \
+            abs(self.__min + index * self.__step - value) <= self.__step * FLOAT_TOLERANCE
+
+    def __eq__(self, other):
+        if not isinstance(other, CandidateRange):
+            return NotImplemented
+        return (self.__min, self.__max, self.__step) == (other.__min, other.__max, other.__step)
+
+    def __hash__(self):
+        return hash((self.__min, self.__max, self.__step))
+
+    def __repr__(self):
+        return "CandidateRange(%r, %r, %r)" % (self.__min, self.__max, self.__step)
+
+
+@lru_cache(maxsize=256)
+def candidate_range(event_name, min_, max_, step):
+    """Memoized CandidateRange for an event"""
+    return CandidateRange(min_, max_, step)
+
+
 def debug_trace():
     """Set a tracepoint in the Python debugger that works with Qt"""
     from PyQt5.QtCore import pyqtRemoveInputHook